@@ -0,0 +1,233 @@
+# audio_io.py
+
+# Reading and writing audio for the filters. WAV/FLAC/OGG (and MP3 on recent libsndfile) go straight
+# through soundfile into preallocated float buffers, anything else is piped through ffmpeg.
+# Filters work on (channels, samples) arrays, both directions can be done block by block for streaming.
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+from filters.common.sample_format import PCM_BITS, to_pcm
+
+DEFAULT_BLOCK_SIZE = 65536
+
+
+def _soundfile_can_read(path):
+    # recent libsndfile builds do MP3 themselves, ffmpeg is only the fallback
+    extension = os.path.splitext(path)[1].lstrip('.').upper()
+    return extension in sf.available_formats()
+
+
+def _ffmpeg(tool='ffmpeg'):
+    executable = shutil.which(tool)
+    if executable is None:
+        raise RuntimeError(f"{tool} is needed for this audio format but was not found on the PATH.")
+    return executable
+
+
+def _probe(path):
+    output = subprocess.run(
+        [_ffmpeg('ffprobe'), '-v', 'error', '-select_streams', 'a:0',
+         '-show_entries', 'stream=sample_rate,channels', '-of', 'csv=p=0', path],
+        capture_output=True, text=True, check=True).stdout
+    sample_rate, channels = output.strip().splitlines()[0].split(',')[:2]
+    return int(sample_rate), int(channels)
+
+
+class AudioReader:
+    # open_audio(path) -> AudioReader, use as a context manager
+    # reader.blocks(n) yields (channels, n) arrays, reader.frames(n) the (n, channels) frames as they are
+    # read (views into a reused buffer, copy what you keep), reader.read() returns the whole track.
+    # reader.length is the number of frames, None for ffmpeg until it's done.
+    # A failed ffmpeg decode raises RuntimeError at the end of the stream, not a track cut short.
+
+    def __init__(self, path, dtype='float32'):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self._file = None
+        self._process = None
+        if _soundfile_can_read(path):
+            self._file = sf.SoundFile(path)
+            self.sample_rate = self._file.samplerate
+            self.channels = self._file.channels
+            self.length = self._file.frames
+        else:
+            self.sample_rate, self.channels = _probe(path)
+            self.length = None  # unknown until ffmpeg is done
+            self._process = subprocess.Popen(
+                [_ffmpeg(), '-v', 'error', '-i', path, '-f', 'f32le', '-acodec', 'pcm_f32le', '-'],
+                stdout=subprocess.PIPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._process is not None:
+            self._process.stdout.close()
+            self._process.wait()
+
+    def frames(self, block_size=DEFAULT_BLOCK_SIZE):
+        # (frames, channels) views into one reused scratch buffer
+        if self._file is not None:
+            scratch = np.empty((block_size, self.channels), dtype=self.dtype)
+            while True:
+                frames = self._file.read(block_size, dtype=self.dtype.name, always_2d=True, out=scratch)
+                if len(frames) == 0:
+                    return
+                yield frames
+                if len(frames) < block_size:
+                    return
+        else:
+            frame_bytes = 4 * self.channels
+            scratch = np.empty((block_size, self.channels), dtype=np.float32)
+            view = memoryview(scratch).cast('B')
+            while True:
+                filled = 0
+                while filled < len(view):
+                    read = self._process.stdout.readinto(view[filled:])
+                    if not read:
+                        break
+                    filled += read
+                frames = filled // frame_bytes
+                if filled < len(view) and self._process.wait() != 0:
+                    raise RuntimeError(f"ffmpeg failed to decode '{self.path}'.")
+                if frames == 0:
+                    return
+                yield scratch[:frames]
+                if filled < len(view):
+                    return
+
+    def blocks(self, block_size=DEFAULT_BLOCK_SIZE):
+        for frames in self.frames(block_size):
+            yield np.array(frames.T, dtype=self.dtype, order='C')
+
+    def read(self, out=None):
+        if self.length is not None:
+            if out is None:
+                out = np.empty((self.channels, self.length), dtype=self.dtype)
+            position = 0
+            for frames in self.frames():
+                out[:, position:position + len(frames)] = frames.T
+                position += len(frames)
+            return out[:, :position]
+        # length of an ffmpeg stream is not known up front
+        blocks = list(self.blocks())
+        if not blocks:
+            return np.zeros((self.channels, 0), dtype=self.dtype)
+        return np.concatenate(blocks, axis=1)
+
+
+def open_audio(path, dtype='float32'):
+    return AudioReader(path, dtype)
+
+
+def read_audio(path, dtype='float32'):
+    with open_audio(path, dtype) as reader:
+        return reader.read(), reader.sample_rate
+
+
+class ScratchSpace:
+    # Temporary directory for disk backed (np.memmap) arrays, removed again on close().
+    # For overnight tracks that would not fit in memory as float arrays.
+
+    def __init__(self, directory=None):
+        self.path = tempfile.mkdtemp(prefix='tinnitus_', dir=directory)
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def array(self, shape, dtype='float32'):
+        self._count += 1
+        return np.memmap(os.path.join(self.path, f"scratch_{self._count}.raw"), dtype=dtype, mode='w+', shape=shape)
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def read_audio_memmap(path, scratch, dtype='float32'):
+    # decodes block by block into a memmap in the scratch space, resident memory stays at one block
+    with open_audio(path, dtype) as reader:
+        if reader.length is not None:
+            data = scratch.array((reader.channels, reader.length), dtype)
+            position = 0
+            for frames in reader.frames():
+                data[:, position:position + len(frames)] = frames.T
+                position += len(frames)
+            return data[:, :position], reader.sample_rate
+
+        # unknown length (ffmpeg), park the interleaved samples on disk first
+        interleaved_path = os.path.join(scratch.path, 'decoded.raw')
+        with open(interleaved_path, 'wb') as file:
+            for frames in reader.frames():
+                file.write(frames.astype(dtype, copy=False).tobytes())
+        interleaved = np.memmap(interleaved_path, dtype=dtype, mode='r').reshape(-1, reader.channels)
+        data = scratch.array((reader.channels, len(interleaved)), dtype)
+        for start in range(0, len(interleaved), DEFAULT_BLOCK_SIZE):
+            data[:, start:start + DEFAULT_BLOCK_SIZE] = interleaved[start:start + DEFAULT_BLOCK_SIZE].T
+        return data, reader.sample_rate
+
+
+class AudioWriter:
+    # write(block) takes (channels, n) float arrays in -1..1, use as a context manager.
+    # For 16 and 24 bit PCM files the samples are quantized here (with TPDF dither unless dither=False),
+    # float subtypes and the ffmpeg pipe get float32.
+
+    def __init__(self, path, sample_rate, channels, subtype=None, dither=True):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dither = dither
+        self._bits = None
+        self._rng = np.random.default_rng()
+        self._file = None
+        self._process = None
+        if _soundfile_can_read(path):
+            self._file = sf.SoundFile(path, 'w', samplerate=sample_rate, channels=channels, subtype=subtype)
+            self._bits = PCM_BITS.get(self._file.subtype)
+        else:
+            self._process = subprocess.Popen(
+                [_ffmpeg(), '-v', 'error', '-y', '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels),
+                 '-i', '-', path],
+                stdin=subprocess.PIPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, block):
+        if self._file is not None and self._bits is not None:
+            self._file.write(to_pcm(block, self._bits, self.dither, self._rng).T)
+        elif self._file is not None:
+            self._file.write(np.asarray(block, dtype=np.float32).T)
+        else:
+            self._process.stdin.write(np.ascontiguousarray(block.T, dtype=np.float32).tobytes())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._process is not None:
+            self._process.stdin.close()
+            if self._process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed to write '{self.path}'.")
+
+
+def write_audio(path, data, sample_rate, subtype=None, dither=True, block_size=DEFAULT_BLOCK_SIZE):
+    with AudioWriter(path, sample_rate, data.shape[0], subtype, dither) as writer:
+        for start in range(0, data.shape[1], block_size):
+            writer.write(data[:, start:start + block_size])
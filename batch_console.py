@@ -0,0 +1,170 @@
+# batch_console.py
+
+# Non interactive counterpart of main_console.py, renders a whole directory (or glob) of tracks
+# with one filter and one parameter file, spread over several processes.
+#
+#   python batch_console.py ladder2 "C:\music\sleep" --params my_values.json --output-dir rendered --workers 4
+#
+# Tracks that already have an output file are skipped, so an interrupted run can simply be restarted.
+# A track is rendered to a temporary file next to its output and only renamed when it's complete,
+# so a half written track never looks finished.
+
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from disk_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DecodeCache, RenderCache
+from filters.common.instrumentation import STAGES, RenderMetrics
+from main_console import FilterManager, process_audio
+
+_manager = None
+
+
+def _init_worker(filter_dir):
+    # every worker process discovers the filters once, not once per track
+    global _manager
+    _manager = FilterManager(filter_dir)
+
+
+def find_tracks(source, pattern):
+    if os.path.isdir(source):
+        source = os.path.join(source, pattern)
+    return sorted(path for path in glob.glob(source) if os.path.isfile(path))
+
+
+def output_path(input_file, output_dir, filter_name):
+    return os.path.join(output_dir, f"{filter_name}_{os.path.basename(input_file)}")
+
+
+def load_parameters(params_file):
+    if not params_file:
+        return {}
+    with open(params_file, 'r') as file:
+        return json.load(file)
+
+
+def render_track(filter_name, parameters, input_file, output_file, scratch_dir=None, cache=None):
+    # cache: (directory, max bytes per cache) for the render and decode caches, None to always decode and render
+    filter_obj = _manager.get_filter(filter_name)
+    filter_obj.adjust_parameters(parameters)
+
+    render_cache = decode_cache = None
+    if cache is not None:
+        directory, max_bytes = cache
+        render_cache = RenderCache(os.path.join(directory, 'renders'), max_bytes)
+        decode_cache = DecodeCache(os.path.join(directory, 'decoded'), max_bytes)
+
+    # same extension, the writer picks the format from it; a leftover of a killed run is simply overwritten
+    temp_file = os.path.join(os.path.dirname(output_file), '.partial_' + os.path.basename(output_file))
+    metrics = RenderMetrics()
+    start = time.perf_counter()
+    try:
+        audio_seconds = process_audio(filter_obj, input_file, temp_file, scratch_dir, render_cache, decode_cache,
+                                      metrics=metrics)
+        os.replace(temp_file, output_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "input": input_file,
+        "output": output_file,
+        "audio_seconds": audio_seconds,
+        "wall_seconds": wall_seconds,
+        "realtime_factor": audio_seconds / wall_seconds if wall_seconds else float('inf'),
+        "stages": metrics.seconds,
+    }
+
+
+def run_batch(filter_name, tracks, parameters, output_dir, workers=None, overwrite=False, filter_dir='filters',
+              scratch_dir=None, cache=None):
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    for track in tracks:
+        target = output_path(track, output_dir, filter_name)
+        if os.path.exists(target) and not overwrite:
+            print(f"Skipping {track}, '{target}' already exists.")
+            continue
+        jobs.append((track, target))
+
+    results = []
+    if not jobs:
+        return results
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(filter_dir,)) as executor:
+        futures = {executor.submit(render_track, filter_name, parameters, track, target, scratch_dir, cache): track
+                   for track, target in jobs}
+        for future in as_completed(futures):
+            track = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Failed {track}: {str(e)}")
+                continue
+            results.append(result)
+            print(f"Done {track}: {result['audio_seconds']:.1f} s audio in {result['wall_seconds']:.1f} s "
+                  f"({result['realtime_factor']:.1f}x realtime)")
+
+    wall_seconds = time.perf_counter() - start
+    audio_seconds = sum(result["audio_seconds"] for result in results)
+    print(f"\nRendered {len(results)} of {len(jobs)} tracks, {audio_seconds:.1f} s audio in {wall_seconds:.1f} s "
+          f"({audio_seconds / wall_seconds if wall_seconds else 0:.1f} audio seconds per second)")
+    stages = {}
+    for result in results:
+        for name, seconds in result["stages"].items():
+            stages[name] = stages.get(name, 0.0) + seconds
+    if stages:
+        names = [name for name in STAGES if name in stages] + [name for name in stages if name not in STAGES]
+        print("Time in all workers: " + ", ".join(f"{name} {stages[name]:.1f} s" for name in names))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a directory of tracks with one filter.")
+    parser.add_argument("filter", help="name of the filter, see main_console.py for the list")
+    parser.add_argument("source", help="directory or glob pattern with the input tracks")
+    parser.add_argument("--params", help="JSON file with parameter values, same format as custom_values.json")
+    parser.add_argument("--output-dir", default="rendered", help="where the rendered tracks go")
+    parser.add_argument("--pattern", default="*.mp3", help="file pattern when source is a directory")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--overwrite", action="store_true", help="render tracks again even if the output exists")
+    parser.add_argument("--scratch-dir", help="keep the audio in memory mapped files here instead of RAM (long tracks)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="directory for the render and decoded audio caches (default: ~/.cache/tinnitus-filters)")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_MAX_BYTES / 2 ** 30,
+                        help="size limit of each cache in GB, least recently used entries go first")
+    parser.add_argument("--no-cache", action="store_true", help="always decode and render, don't use the caches")
+    args = parser.parse_args()
+
+    filter_name = args.filter.lower()
+    filter_obj = FilterManager().get_filter(filter_name)
+    if filter_obj is None:
+        print(f"Filter '{filter_name}' not found.")
+        return
+
+    # check the parameter file up front, not after the first track has been decoded
+    parameters = load_parameters(args.params)
+    try:
+        filter_obj.adjust_parameters(parameters)
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        return
+
+    tracks = find_tracks(args.source, args.pattern)
+    if not tracks:
+        print(f"No tracks found in '{args.source}'.")
+        return
+
+    cache = None if args.no_cache else (args.cache_dir, int(args.cache_size * 2 ** 30))
+    run_batch(filter_name, tracks, parameters, args.output_dir, args.workers, args.overwrite,
+              scratch_dir=args.scratch_dir, cache=cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# bench_ladder_schedule.py
+
+# Compares the old one-step-at-a-time ladder loop with the precomputed step schedule.
+# Both filter every step on its own (filtfilt, so two lfilter passes), which is most of the time
+# either way: "lfilter floor" is just those passes over the whole track, the most any way of looping
+# over the steps can get down to without giving up the per step restart.
+# Every rung is designed once, so the notch cache only sees misses (one per rung).
+# Run from the repository root: python benchmarks/bench_ladder_schedule.py [seconds] [sample_rate]
+
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.signal import filtfilt, iirnotch, lfilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from filters.common.ladder import build_ladder_schedule, filter_steps, ladder_frequencies, render_beeps
+from filters.common.notch_cache import cache_stats, iirnotch_coefficients
+
+
+def per_step_ladder(data, sample_rate, frequencies, step_samples, beep_samples, q_factor):
+    # the loop as it was in Ladder2.process_audio
+    filtered_audio = np.zeros_like(data)
+    beep_audio = np.zeros_like(data)
+    for i in range(-(-data.shape[1] // step_samples)):
+        freq = frequencies[i % len(frequencies)]
+        start_sample = i * step_samples
+        end_sample = min(start_sample + step_samples, data.shape[1])
+        b, a = iirnotch(freq / (0.5 * sample_rate), q_factor)
+        filtered_audio[:, start_sample:end_sample] = filtfilt(b, a, data[:, start_sample:end_sample])
+
+        t = np.linspace(0, beep_samples / sample_rate, beep_samples, False)
+        beep = np.zeros((2, beep_samples))
+        beep[i % 2] = np.sin(2 * np.pi * freq * t)
+        beep_end = min(start_sample + beep_samples, data.shape[1])
+        beep_audio[:, start_sample:beep_end] += beep[:, :beep_end - start_sample]
+    return filtered_audio, beep_audio
+
+
+def scheduled_ladder(data, sample_rate, frequencies, step_samples, beep_samples, q_factor):
+    schedule = build_ladder_schedule(data.shape[1], step_samples, frequencies)
+    filtered_audio = np.empty_like(data)
+    filter_steps(data, schedule, lambda freq: iirnotch_coefficients(freq, q_factor, sample_rate), filtered_audio)
+    beep_audio = np.zeros_like(data)
+    render_beeps(schedule, beep_samples, sample_rate, beep_audio)
+    return filtered_audio, beep_audio
+
+
+def lfilter_floor(data, sample_rate, frequencies, step_samples, beep_samples, q_factor):
+    b, a = iirnotch(frequencies[0] / (0.5 * sample_rate), q_factor)
+    return lfilter(b, a, lfilter(b, a, data)[:, ::-1])[:, ::-1], None
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 600
+    sample_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 44100
+    step_samples = int(0.1 * sample_rate)
+    beep_samples = int(0.01 * sample_rate)
+    frequencies = ladder_frequencies(8996, 11000, 500)
+    data = np.random.default_rng(0).standard_normal((2, int(seconds * sample_rate)))
+    num_steps = -(-data.shape[1] // step_samples)
+
+    print(f"{seconds:.0f} s stereo at {sample_rate} Hz, {num_steps} steps of 0.1 s")
+    results = {}
+    for name, run in (("per-step loop", per_step_ladder), ("step schedule", scheduled_ladder),
+                      ("lfilter floor", lfilter_floor)):
+        start = time.perf_counter()
+        results[name] = run(data, sample_rate, frequencies, step_samples, beep_samples, 30)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:14s} {elapsed:8.3f} s  {num_steps / elapsed:10.0f} steps/s")
+
+    old, new = results["per-step loop"], results["step schedule"]
+    print(f"  max difference: filtered {np.max(np.abs(old[0] - new[0])):.2e}, beeps {np.max(np.abs(old[1] - new[1])):.2e}")
+    print(f"  notch cache: {cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
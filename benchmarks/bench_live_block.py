@@ -0,0 +1,71 @@
+# bench_live_block.py
+
+# Time per callback of the Ladder2 live processor against the time the block lasts, and the
+# most memory a callback allocates at once (tracemalloc peak), for a few block sizes. A callback
+# may create a few array views, but no buffer that grows with the block: the peak has to stay under
+# PEAK_LIMIT and be the same for every block size, or the benchmark fails.
+# A parameter change is published every FADE_EVERY blocks, so the fade path is measured too.
+# Run from the repository root: python benchmarks/bench_live_block.py [sample_rate]
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from filters.Ladder2.Ladder2 import TinnitusFilter
+
+BLOCKS = 2000
+FADE_EVERY = 100
+PEAK_LIMIT = 1024  # bytes, a single (1024, 2) float32 block is 8 kB
+PEAK_SPREAD = 256  # bytes between the smallest and the largest block size
+
+
+def main():
+    sample_rate = int(sys.argv[1]) if len(sys.argv) > 1 else 44100
+    filter_dir = os.path.join(ROOT, 'filters', 'Ladder2')
+    filter_obj = TinnitusFilter(os.path.join(filter_dir, 'translations.json'),
+                                os.path.join(filter_dir, 'default_values.json'))
+    rng = np.random.default_rng(0)
+
+    peaks = {}
+    for block_size in (64, 128, 256, 512, 1024):
+        processor = filter_obj.live_processor(sample_rate, block_size)
+        block = (0.1 * rng.standard_normal((block_size, 2))).astype(processor.dtype)
+        out = np.empty_like(block)
+        for _ in range(100):
+            processor.process(block, out)
+
+        start = time.perf_counter()
+        for _ in range(BLOCKS):
+            processor.process(block, out)
+        per_block = (time.perf_counter() - start) / BLOCKS
+
+        # designs are built outside the callback, like a parameter change from the UI thread
+        designs = [filter_obj.live_design(sample_rate, block_size) for _ in range(2)]
+        tracemalloc.start()
+        peak = 0
+        for index in range(BLOCKS):
+            if index % FADE_EVERY == 0:
+                processor.publish(designs[index // FADE_EVERY % 2])
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            processor.process(block, out)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+        peaks[block_size] = peak
+
+        block_seconds = block_size / sample_rate
+        print(f"block {block_size:5d} ({block_seconds * 1000:5.1f} ms)  callback {per_block * 1e6:8.1f} us "
+              f"({per_block / block_seconds * 100:5.1f}% of the block)  peak allocation {peak:5d} B/callback")
+
+    assert max(peaks.values()) < PEAK_LIMIT, f"a callback allocated up to {max(peaks.values())} bytes"
+    assert max(peaks.values()) - min(peaks.values()) < PEAK_SPREAD, f"the allocation grows with the block: {peaks}"
+
+
+if __name__ == "__main__":
+    main()
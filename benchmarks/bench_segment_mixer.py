@@ -0,0 +1,62 @@
+# bench_segment_mixer.py
+
+# The old bandfilter-5 segment loop against SegmentMixer for growing track lengths.
+# The old loop grows quadratically, the mixer linearly (time per minute of audio stays flat).
+# Run from the repository root: python benchmarks/bench_segment_mixer.py [max_minutes] [sample_rate]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from filters.common.segment_mixer import SegmentMixer
+
+SEGMENTS = [
+    ("Original + Notched", {"original": 0.7, "notched": 0.3}),
+    ("Original + Ladder", {"original": 0.7, "ladder": 0.3}),
+    ("Original + FM Tone", {"original": 0.7, "fm": 0.3}),
+    ("Original + Matched Noise", {"original": 0.7, "noise": 0.3}),
+    ("All Combined", {"original": 0.4, "notched": 0.15, "ladder": 0.15, "fm": 0.15, "noise": 0.15}),
+]
+
+
+def old_segment_loop(treatments, samples_per_segment):
+    # as it was in create_dynamic_tinnitus_treatment
+    mixed_audio = np.zeros_like(treatments["original"])
+    for i in range(0, mixed_audio.shape[1], samples_per_segment):
+        segment_index = (i // samples_per_segment) % len(SEGMENTS)
+        segment_name, segment_mix = SEGMENTS[segment_index]
+        end_index = min(i + samples_per_segment, mixed_audio.shape[1])
+        segment_audio = sum(treatments[key] * volume for key, volume in segment_mix.items())
+        mixed_audio[:, i:end_index] = segment_audio[:, i:end_index]
+    return mixed_audio
+
+
+def main():
+    max_minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    sample_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 44100
+    samples_per_segment = 4 * sample_rate
+    mixer = SegmentMixer(SEGMENTS, samples_per_segment)
+    rng = np.random.default_rng(0)
+
+    minutes = 1
+    while minutes <= max_minutes:
+        samples = minutes * 60 * sample_rate
+        treatments = {key: rng.standard_normal((2, samples)) for key in ("original", "notched", "ladder", "fm", "noise")}
+        start = time.perf_counter()
+        old = old_segment_loop(treatments, samples_per_segment)
+        old_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        new = mixer.mix(treatments, samples)
+        new_seconds = time.perf_counter() - start
+        print(f"{minutes:3d} min  old loop {old_seconds:8.3f} s ({old_seconds / minutes:6.3f} s/min)  "
+              f"mixer {new_seconds:7.3f} s ({new_seconds / minutes:6.3f} s/min)  "
+              f"max difference {np.max(np.abs(old - new)):.1e}")
+        minutes *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# bench_sessions.py
+
+# Headless sessions (sessions.py): how many simulated tone finder sessions run per minute, how many
+# answers they need and how close they get, and how fast a configured filter renders without
+# a sound card or files.
+# Run from the repository root: python benchmarks/bench_sessions.py [sessions]
+
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import synthetic_stereo
+from sessions import FilterSession, simulate_tone_sessions, summarize_tone_sessions
+
+RENDER_SECONDS = 30
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    for jitter_cents, octave_error_rate in ((0, 0), (30, 0), (30, 0.3)):
+        summary = summarize_tone_sessions(
+            simulate_tone_sessions(count, jitter_cents=jitter_cents, octave_error_rate=octave_error_rate))
+        print(f"jitter {jitter_cents:3d} cents, octave errors {octave_error_rate:.0%}: "
+              f"{summary['sessions_per_minute']:8.0f} sessions/min, {summary['mean_answers']:.1f} answers "
+              f"(max {summary['max_answers']}), error median {summary['median_error_cents']:.1f} "
+              f"p95 {summary['p95_error_cents']:.1f} cents, {summary['octave_misses']} octave misses")
+
+    sample_rate = 44100
+    samples = synthetic_stereo(RENDER_SECONDS, sample_rate)
+    session = FilterSession("ladder2")
+    for values in ({"engine": "iir", "filter_mode": "stepwise"}, {"engine": "iir", "filter_mode": "continuous"},
+                   {"engine": "fft"}):
+        session.configure(**values)
+        start = time.perf_counter()
+        session.render(samples, sample_rate)
+        elapsed = time.perf_counter() - start
+        print(f"ladder2 {values}: {RENDER_SECONDS / elapsed:6.1f}x realtime, "
+              f"{samples.shape[1] / elapsed / 1e6:.2f} M samples/s per channel")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# bench_threads.py
+
+# Times TinnitusFilter.process_audio with 1..8 filter threads on 2 and 8 channel input and checks
+# the output is identical to the single threaded run.
+# Run from the repository root: python benchmarks/bench_threads.py [seconds] [sample_rate]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from filters.Ladder2.Ladder2 import TinnitusFilter
+
+FILTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'filters', 'Ladder2')
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 120
+    sample_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 44100
+    filter_obj = TinnitusFilter(os.path.join(FILTER_DIR, 'translations.json'),
+                                os.path.join(FILTER_DIR, 'default_values.json'))
+    rng = np.random.default_rng(0)
+
+    for channels in (2, 8):
+        data = rng.standard_normal((channels, int(seconds * sample_rate)))
+        for mode in ("stepwise", "continuous"):
+            filter_obj.adjust_parameter("filter_mode", mode)
+            print(f"{channels} channels, {seconds:.0f} s at {sample_rate} Hz, {mode}")
+            reference = None
+            for threads in (1, 2, 4, 8):
+                filter_obj.adjust_parameter("num_threads", threads)
+                start = time.perf_counter()
+                result = filter_obj.process_audio(data, sample_rate)
+                elapsed = time.perf_counter() - start
+                if reference is None:
+                    reference, single = result, elapsed
+                identical = np.array_equal(reference, result)
+                print(f"  {threads} threads {elapsed:8.3f} s  {single / elapsed:5.2f}x  identical: {identical}")
+
+
+if __name__ == "__main__":
+    main()
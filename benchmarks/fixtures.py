@@ -0,0 +1,29 @@
+# fixtures.py
+
+# Synthetic test audio for the benchmarks, generated offline so no music files are needed.
+# Music-like enough for the filters: a few drifting tones, some energy around 10 kHz and soft noise.
+
+import numpy as np
+import soundfile as sf
+
+
+def synthetic_stereo(seconds, sample_rate=44100, seed=0, dtype=np.float32):
+    rng = np.random.default_rng(seed)
+    samples = int(seconds * sample_rate)
+    audio = np.empty((2, samples), dtype=dtype)
+    block = 2 ** 18
+    phases = rng.random((2, 4)) * 2 * np.pi
+    freqs = np.array([220.0, 440.0, 3300.0, 9996.0])
+    gains = np.array([0.3, 0.2, 0.05, 0.02])
+    for start in range(0, samples, block):
+        t = np.arange(start, min(start + block, samples)) / sample_rate
+        for channel in range(2):
+            tones = gains[:, None] * np.sin(2 * np.pi * freqs[:, None] * t[None, :] + phases[channel, :, None])
+            noise = 0.02 * rng.standard_normal(len(t))
+            audio[channel, start:start + len(t)] = tones.sum(axis=0) + noise
+    return audio
+
+
+def write_fixture(path, seconds, sample_rate=44100, seed=0):
+    sf.write(path, synthetic_stereo(seconds, sample_rate, seed).T, sample_rate, subtype='FLOAT')
+    return path
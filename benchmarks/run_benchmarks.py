@@ -0,0 +1,211 @@
+# run_benchmarks.py
+
+# Benchmark suite for the filters. Every case runs on synthetic audio (see fixtures.py) in a fresh
+# process, so peak RSS belongs to that case alone. Results go to a JSON report that can be compared
+# with the report of another commit.
+#
+#   python benchmarks/run_benchmarks.py --seconds 300 --output bench_report.json
+#   python benchmarks/run_benchmarks.py --compare old_report.json bench_report.json
+#
+# The Ladder2 cases climb a ladder of 0.1 s steps that lasts the whole track (Ladder2 climbs it once,
+# at the default values it would be over after 0.4 s and the rest only the dry mix would be timed).
+# The bandfilter scripts read through the decode cache (disk_cache.py), so apart from the very first
+# run their numbers leave out decoding.
+
+import argparse
+import functools
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import synthetic_stereo, write_fixture
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+LADDER2_STEP_SECONDS = 0.1
+
+
+def load_script(relative_path):
+    # the old filters are scripts with dashes in their names, load them by path
+    path = os.path.join(ROOT, relative_path)
+    name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_bytes():
+    if resource is None:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def prepare_ladder2(workdir, seconds, sample_rate, engine="iir", filter_mode="stepwise"):
+    from filters.Ladder2.Ladder2 import TinnitusFilter
+    filter_dir = os.path.join(ROOT, 'filters', 'Ladder2')
+    filter_obj = TinnitusFilter(os.path.join(filter_dir, 'translations.json'),
+                                os.path.join(filter_dir, 'default_values.json'))
+    # enough rungs between start_freq and end_freq for the ladder to last the whole track
+    steps = math.ceil(seconds / LADDER2_STEP_SECONDS)
+    span = filter_obj.get_value("end_freq") - filter_obj.get_value("start_freq")
+    filter_obj.adjust_parameters({"engine": engine, "filter_mode": filter_mode, "step_duration": LADDER2_STEP_SECONDS,
+                                  "bandwidth": span / (steps + 0.5)})
+    audio = synthetic_stereo(seconds, sample_rate)
+    return lambda: filter_obj.process_audio(audio, sample_rate)
+
+
+def prepare_bandfilter4(workdir, seconds, sample_rate):
+    script = load_script(os.path.join('filters', '_old_', 'bandfilter-4.py'))
+    input_file = write_fixture(os.path.join(workdir, 'fixture.wav'), seconds, sample_rate)
+    return lambda: script.create_ladder_notched_music_with_stereo_beeps(
+        input_file, workdir, script.start_freq, script.end_freq, script.bandwidth, script.step_duration,
+        script.beep_duration, script.q_factor, script.filter_mix_ratio, script.beep_mix_ratio)
+
+
+def prepare_bandfilter5(workdir, seconds, sample_rate):
+    script = load_script(os.path.join('filters', '_old_', 'bandfilter-5.py'))
+    input_file = write_fixture(os.path.join(workdir, 'fixture.wav'), seconds, sample_rate)
+    params = dict(script.params, duration=seconds)
+    return lambda: script.create_dynamic_tinnitus_treatment(input_file, workdir, params)
+
+
+CASES = {
+    "ladder2": prepare_ladder2,
+    "ladder2_continuous": functools.partial(prepare_ladder2, filter_mode="continuous"),
+    "ladder2_fft": functools.partial(prepare_ladder2, engine="fft"),
+    "bandfilter-4": prepare_bandfilter4,
+    "bandfilter-5": prepare_bandfilter5,
+}
+
+
+def run_case(name, seconds, sample_rate, trace_allocations):
+    # runs in its own process
+    with tempfile.TemporaryDirectory(prefix='tinnitus_bench_') as workdir:
+        try:
+            run = CASES[name](workdir, seconds, sample_rate)
+        except ImportError as e:
+            return {"name": name, "skipped": str(e)}
+
+        rss_before = peak_rss_bytes()
+        start = time.perf_counter()
+        run()
+        wall_seconds = time.perf_counter() - start
+        rss_after = peak_rss_bytes()
+
+        result = {
+            "name": name,
+            "audio_seconds": seconds,
+            "sample_rate": sample_rate,
+            "wall_seconds": wall_seconds,
+            "realtime_factor": seconds / wall_seconds,
+            "peak_rss_bytes": rss_after,
+            "peak_rss_growth_bytes": rss_after - rss_before if rss_after is not None else None,
+        }
+        if trace_allocations:
+            # separate run, tracemalloc slows everything down too much to time it at the same time.
+            # traced_peak_bytes: the most the run had allocated at once, its output included;
+            # retained_bytes: what is still allocated after it, caches and whatever the filter holds on to
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            run()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result["traced_peak_bytes"] = peak - before
+            result["retained_bytes"] = current - before
+        return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names, seconds, sample_rate, trace_allocations=True):
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "cases": [],
+    }
+    context = multiprocessing.get_context('spawn')
+    for name in names:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_case, (name, seconds, sample_rate, trace_allocations))
+        report["cases"].append(result)
+        if "skipped" in result:
+            print(f"{name:20s} skipped: {result['skipped']}")
+        else:
+            print(f"{name:20s} {result['wall_seconds']:8.2f} s  {result['realtime_factor']:7.1f}x realtime  "
+                  f"peak RSS {(result['peak_rss_bytes'] or 0) / 2 ** 20:7.1f} MB")
+    return report
+
+
+def compare_reports(old_path, new_path):
+    with open(old_path) as file:
+        old = {case["name"]: case for case in json.load(file)["cases"]}
+    with open(new_path) as file:
+        new = {case["name"]: case for case in json.load(file)["cases"]}
+    for name, case in new.items():
+        before = old.get(name)
+        if before is None or "skipped" in case or "skipped" in before:
+            continue
+        print(f"{name:20s} wall {before['wall_seconds']:8.2f} -> {case['wall_seconds']:8.2f} s "
+              f"({before['wall_seconds'] / case['wall_seconds']:5.2f}x)  "
+              f"peak RSS {(before['peak_rss_bytes'] or 0) / 2 ** 20:7.1f} -> "
+              f"{(case['peak_rss_bytes'] or 0) / 2 ** 20:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the filters on synthetic audio.")
+    parser.add_argument("--seconds", type=float, default=120, help="length of the synthetic track")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--cases", nargs="*", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--no-allocations", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+
+    report = run_suite(args.cases, args.seconds, args.sample_rate, not args.no_allocations)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=4)
+    print(f"\nReport saved as '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
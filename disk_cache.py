@@ -0,0 +1,282 @@
+# disk_cache.py
+
+# Content addressed caches on disk. An entry is a file named after the hash of everything that
+# determines it (input file contents, filter, parameters...), so an identical request finds the
+# result of the last one and anything that changed gets a new key.
+#
+# There is no index file, every process (batch workers too) can use the same directory at the same time:
+# entries are written to a temporary file and renamed into place, a hit touches the file's mtime,
+# and eviction removes the least recently used entries once the directory is over its size limit.
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from audio_io import open_audio
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'tinnitus-filters')
+DEFAULT_MAX_BYTES = 10 * 2 ** 30
+
+_digests = {}
+
+
+def file_digest(path, block_size=2 ** 20):
+    # sha256 of the file contents, remembered per (path, mtime, size) for the rest of the process
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                hasher.update(block)
+        digest = _digests[memo_key] = hasher.hexdigest()
+    return digest
+
+
+def make_key(*parts):
+    # parts: anything JSON can write
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _write_file(path, write):
+    with open(path, 'wb') as file:
+        write(file)
+
+
+class DiskCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, suffix=''):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key, suffix=''):
+        # path of the entry or None, a hit counts as use for the LRU order
+        path = self.path(key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, source_path, suffix='', meta=None):
+        # copies source_path into the cache, meta (a dict) is kept next to it
+        path = self.path(key, suffix)
+        if meta is not None:
+            self._write(key + '.json', lambda file: file.write(json.dumps(meta).encode()))
+        with open(source_path, 'rb') as source:
+            self._write(key + suffix, lambda file: shutil.copyfileobj(source, file))
+        self.evict(keep=key)
+        return path
+
+    def meta(self, key):
+        try:
+            with open(self.path(key, '.json'), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, name, write):
+        # write(file) fills a temporary file, which then replaces the entry in one go
+        self._fill(name, lambda temp_path: _write_file(temp_path, write))
+
+    def _fill(self, name, fill):
+        # same with fill(path), for writers that want a path (np.lib.format.open_memmap)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp_')
+        os.close(handle)
+        try:
+            fill(temp_path)
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def entries(self):
+        # [(mtime, size, path)] of the finished entries
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.tmp_'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def usage(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        # keep: key of the entry just stored, it stays even if it alone is over the limit
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and os.path.basename(path).startswith(keep):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue  # still mapped by someone (Windows), try again next time
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def source_digest(module_name, extra_dirs=()):
+    # hash of a module's source and the sources it shares code with, stands in for a version number:
+    # any edit to the filter code gives new cache keys
+    module = sys.modules[module_name]
+    paths = [module.__file__]
+    for directory in extra_dirs:
+        paths.extend(sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.py')))
+    return make_key(*(file_digest(path) for path in paths))
+
+
+class RenderCache(DiskCache):
+    # rendered tracks, keyed by input file contents, filter (class, version, code) and its parameters
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory or os.path.join(DEFAULT_CACHE_DIR, 'renders'), max_bytes)
+
+    def render_key(self, input_file, filter_obj, output_file):
+        filter_class = type(filter_obj)
+        common_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filters', 'common')
+        if hasattr(filter_obj, 'get_parameters'):
+            parameters = filter_obj.get_parameters().as_dict()
+        else:
+            parameters = {name: filter_obj.get_value(name) for name in filter_obj.default_values}
+        return make_key(
+            file_digest(input_file),
+            f"{filter_class.__module__}.{filter_class.__qualname__}",
+            getattr(filter_obj, 'version', None),
+            source_digest(filter_class.__module__, [common_dir]),
+            parameters,
+            os.path.splitext(output_file)[1].lower(),
+        )
+
+    def fetch(self, key, output_file):
+        # copies a cached render to output_file, returns its meta or None on a miss
+        path = self.get(key, self.suffix(output_file))
+        if path is None or self.get(key, '.json') is None:
+            return None
+        meta = self.meta(key)
+        try:
+            shutil.copyfile(path, output_file)
+        except FileNotFoundError:
+            return None  # evicted by another process just now
+        return meta
+
+    def store(self, key, output_file, meta):
+        self.put(key, output_file, self.suffix(output_file), meta)
+
+    def suffix(self, output_file):
+        return os.path.splitext(output_file)[1].lower()
+
+
+class DecodeCache(DiskCache):
+    # Decoded tracks as float32 .npy files, keyed by the file contents and the sample rate. Loading
+    # a cached track maps the file instead of decoding it: a second filter on the same song, or the
+    # same filter again, starts right away and only touches the pages it reads.
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(directory or os.path.join(DEFAULT_CACHE_DIR, 'decoded'), max_bytes)
+
+    def load(self, path, sample_rate=None):
+        # (channels, samples) read-only float32 memmap and its sample rate; sample_rate None keeps the
+        # file's own rate, anything else is resampled once and cached as such
+        digest = file_digest(path)
+        found = self._cached(digest, sample_rate)
+        if found is not None:
+            return found
+        native = self._cached(digest, None)
+        if native is None:
+            self._decode(digest, path)
+            native = self._cached(digest, None)
+            if native is None:
+                # removed by another process right away, read it without the cache
+                with open_audio(path) as reader:
+                    native = reader.read(), reader.sample_rate
+        if sample_rate is None or sample_rate == native[1]:
+            return native
+        self._resample(native, digest, sample_rate)
+        resampled = self._cached(digest, sample_rate)
+        return resampled if resampled is not None else self._resampled(native, sample_rate)
+
+    def _key(self, digest, sample_rate):
+        return make_key(digest, sample_rate, 'float32')
+
+    def _cached(self, digest, sample_rate):
+        key = self._key(digest, sample_rate)
+        path = self.get(key, '.npy')
+        if path is None or self.get(key, '.json') is None:
+            return None
+        try:
+            return np.load(path, mmap_mode='r'), self.meta(key)["sample_rate"]
+        except (OSError, ValueError, TypeError):
+            return None  # evicted or broken, decode again
+
+    def _store_meta(self, key, sample_rate):
+        self._write(key + '.json', lambda file: file.write(json.dumps({"sample_rate": sample_rate}).encode()))
+        self.evict(keep=key)
+
+    def _decode(self, digest, path):
+        # decodes straight into the .npy file
+        key = self._key(digest, None)
+        with open_audio(path) as reader:
+            if reader.length is None:
+                # ffmpeg, length unknown up front
+                data = reader.read()
+                self._write(key + '.npy', lambda file: np.save(file, data))
+            else:
+                def fill(temp_path):
+                    data = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32,
+                                                     shape=(reader.channels, reader.length))
+                    position = 0
+                    for frames in reader.frames():
+                        data[:, position:position + len(frames)] = frames.T
+                        position += len(frames)
+                    data.flush()
+                    del data
+                self._fill(key + '.npy', fill)
+            self._store_meta(key, reader.sample_rate)
+
+    def _resampled(self, native, sample_rate):
+        from math import gcd
+        from scipy.signal import resample_poly
+        source, source_rate = native
+        common = gcd(int(source_rate), int(sample_rate))
+        data = resample_poly(source, int(sample_rate) // common, int(source_rate) // common, axis=1).astype(np.float32)
+        return data, sample_rate
+
+    def _resample(self, native, digest, sample_rate):
+        data, _ = self._resampled(native, sample_rate)
+        key = self._key(digest, sample_rate)
+        self._write(key + '.npy', lambda file: np.save(file, data))
+        self._store_meta(key, sample_rate)
+
+
+def load_audio(path, sample_rate=None, mono=True, duration=None, cache=None):
+    # librosa.load(path, sr=sample_rate, mono=mono, duration=duration) through the decode cache, for the
+    # filter scripts: float32, 1-D for mono, (channels, samples) otherwise
+    data, sample_rate = (cache or DecodeCache()).load(path, sample_rate)
+    if duration is not None:
+        data = data[:, :int(round(duration * sample_rate))]
+    if mono and data.shape[0] > 1:
+        return data.mean(axis=0, dtype=np.float32), sample_rate
+    # the cache entry is a read-only memmap, the caller gets a writable array of its own like from librosa
+    return np.array(data[0] if data.shape[0] == 1 else data), sample_rate
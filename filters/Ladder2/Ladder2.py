@@ -6,18 +6,100 @@
 
 
 import json
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from scipy.signal import iirnotch, filtfilt
+from scipy.signal import lfilter
+
+from filters.common.instrumentation import RenderMetrics
+from filters.common.ladder import (ContinuousLadderFilter, build_ladder_schedule, filter_steps_threaded,
+                                   ladder_frequencies, render_beeps)
+from filters.common.live_ladder import LadderDesign, LiveLadder
+from filters.common.loudness import LevelMeter, apply_gain, loudness_gain, peak_gain
+from filters.common.notch_cache import iirnotch_coefficients
+from filters.common.oscillator import BeepBank
+from filters.common.parameters import Parameter, ParameterSet, compile_parameters
+from filters.common.sample_format import INTERNAL_DTYPES, internal_dtype, to_internal
+from filters.common.stft_engine import SpectralLadderNotch
+
+
+class LadderParameters(ParameterSet):
+    specs = (
+        Parameter("start_freq", above=0),
+        Parameter("end_freq", above=0),
+        Parameter("bandwidth", above=0),
+        Parameter("step_duration", above=0),
+        Parameter("beep_duration", minimum=0),
+        Parameter("q_factor", above=0),
+        Parameter("filter_mix_ratio", minimum=0, maximum=1),
+        Parameter("beep_mix_ratio", minimum=0, maximum=1),
+        Parameter("filter_mode", choices=("stepwise", "continuous")),
+        Parameter("crossfade_duration", minimum=0),
+        Parameter("num_threads", int, minimum=1),
+        Parameter("precision", choices=tuple(INTERNAL_DTYPES)),
+        Parameter("engine", choices=("iir", "fft")),
+        Parameter("fft_size", int, minimum=2),
+        Parameter("normalize", choices=("off", "peak", "loudness")),
+        Parameter("target_peak_db", maximum=0),
+        Parameter("target_lufs", maximum=0),
+    )
+    __slots__ = tuple(spec.name for spec in specs)
+
+    def check(self):
+        if self.end_freq < self.start_freq:
+            raise ValueError(f"end_freq ({self.end_freq}) is below start_freq ({self.start_freq})")
+        if self.fft_size % 2:
+            raise ValueError(f"fft_size must be even, not {self.fft_size}")
+
+    def at_rate(self, sample_rate):
+        # filter_mode: "stepwise" runs every step through its own notch (filtfilt offline),
+        # "continuous" is one causal pass where the filter state runs on from step to step.
+        # engine "fft" replaces both with overlap-add notching in the frequency domain (offline only)
+        # normalize needs the whole track, so only process_audio does it; streamed and live output keep their level
+        if self.end_freq >= sample_rate / 2:
+            raise ValueError(f"end_freq ({self.end_freq}) must be below half the sample rate ({sample_rate / 2})")
+        step_samples = int(self.step_duration * sample_rate)
+        if step_samples < 1:
+            raise ValueError(f"step_duration ({self.step_duration}) is shorter than one sample at {sample_rate} Hz")
+        return {
+            "start_freq": self.start_freq,
+            "end_freq": self.end_freq,
+            "bandwidth": self.bandwidth,
+            "num_steps": max(1, int((self.end_freq - self.start_freq) / self.bandwidth)),
+            "step_samples": step_samples,
+            "beep_duration": self.beep_duration,
+            "beep_samples": int(self.beep_duration * sample_rate),
+            "q_factor": self.q_factor,
+            "filter_mix_ratio": self.filter_mix_ratio,
+            "beep_mix_ratio": self.beep_mix_ratio,
+            "filter_mode": self.filter_mode,
+            "crossfade_samples": int(self.crossfade_duration * sample_rate),
+            "num_threads": self.num_threads,
+            "dtype": internal_dtype(self.precision),
+            "engine": self.engine,
+            "fft_size": self.fft_size,
+            "normalize": self.normalize,
+            "target_peak": 10 ** (self.target_peak_db / 20),
+            "target_lufs": self.target_lufs,
+        }
+
 
 class TinnitusFilter:
+    # part of the render cache key, bump it when the output changes for reasons outside this code
+    version = 1
+    # process_audio works through the track in chunks of about this many samples (rounded to whole steps)
+    render_chunk_samples = 2 ** 20
+
     def __init__(self, translations_file, default_values_file, custom_values_file=None):
         self.translations = self.load_json(translations_file)
         self.default_values = self.load_json(default_values_file)
         self.custom_values = self.load_json(custom_values_file) if custom_values_file else {}
+        self.parameters = None
         self.language = "en"
         self.raw_in = None
         self.raw_out = None
         self.sample_rate = None
+        self.levels = None  # peak, lufs and gain of the last normalized render
 
     def load_json(self, file_path):
         try:
@@ -27,8 +109,16 @@ class TinnitusFilter:
             print(f"Warning: File {file_path} not found. Using empty dictionary.")
             return {}
 
+    def compile_parameters(self):
+        # FilterManager does this when it loads the filter, so a bad JSON value fails right away
+        self.parameters = compile_parameters(LadderParameters, self.default_values, self.custom_values)
+        return self.parameters
+
+    def get_parameters(self):
+        return self.parameters if self.parameters is not None else self.compile_parameters()
+
     def get_value(self, key):
-        return self.custom_values.get(key, self.default_values.get(key))
+        return getattr(self.get_parameters(), key, None) if key in LadderParameters.names() else None
 
     def get_translation(self, key):
         return self.translations.get(key, {}).get(self.language, key)
@@ -39,58 +129,253 @@ class TinnitusFilter:
         else:
             raise ValueError(f"Unsupported language: {language}")
 
-    def generate_alternating_stereo_beep(self, freq, duration, sample_rate, left_channel):
-        t = np.linspace(0, duration, int(sample_rate * duration), False)
-        beep = np.sin(2 * np.pi * freq * t)
-        stereo_beep = np.zeros((2, len(beep)))
-        stereo_beep[0 if left_channel else 1] = beep
-        return stereo_beep
+    def get_ladder_settings(self, sample_rate):
+        # the settings for one sample rate, see LadderParameters.at_rate (computed once per rate, don't modify)
+        return self.get_parameters().derived(sample_rate)
 
-    def apply_notch_filter(self, data, freq, q, fs):
-        nyq = 0.5 * fs
-        freq_normalized = freq / nyq
-        b, a = iirnotch(freq_normalized, q)
-        return filtfilt(b, a, data)
+    def ladder_frequencies(self, settings):
+        return ladder_frequencies(settings["start_freq"], settings["end_freq"], settings["bandwidth"])
 
-    def process_audio(self, audio_data, sample_rate):
+    def notch_design(self, settings, sample_rate, output='ba', frequencies=None):
+        # coefficients in the working precision, so scipy filters float32 audio as float32.
+        # With frequencies those are designed right away, so the filtering only looks them up.
+        q_factor = settings["q_factor"]
+        dtype = settings["dtype"]
+        if output == 'sos':
+            design = lambda freq: iirnotch_coefficients(freq, q_factor, sample_rate, output='sos').astype(dtype)
+        else:
+            design = lambda freq: tuple(c.astype(dtype) for c in iirnotch_coefficients(freq, q_factor, sample_rate))
+        if frequencies is None:
+            return design
+        designed = {float(freq): design(freq) for freq in frequencies}
+
+        def predesigned(freq):
+            coefficients = designed.get(float(freq))
+            return design(freq) if coefficients is None else coefficients
+        return predesigned
+
+    def continuous_filter(self, settings, sample_rate, design_sos=None):
+        return ContinuousLadderFilter(
+            self.ladder_frequencies(settings), settings["step_samples"],
+            design_sos or self.notch_design(settings, sample_rate, output='sos'), settings["crossfade_samples"])
+
+    def spectral_filter(self, settings, sample_rate):
+        return SpectralLadderNotch(self.ladder_frequencies(settings), settings["step_samples"],
+                                   self.notch_design(settings, sample_rate), sample_rate, settings["fft_size"])
+
+    def continuous_filters(self, settings, sample_rate, channels, frequencies=None):
+        # the filter state runs on through time, so only the channels can be split over threads:
+        # one filter per channel when threaded, otherwise one filter for all channels
+        design_sos = self.notch_design(settings, sample_rate, output='sos', frequencies=frequencies)
+        if min(settings["num_threads"], channels) <= 1:
+            return [self.continuous_filter(settings, sample_rate, design_sos)]
+        return [self.continuous_filter(settings, sample_rate, design_sos) for _ in range(channels)]
+
+    def filter_continuous(self, audio_data, out, filters, threads=1):
+        # one filter per channel, at most threads of them at a time
+        if len(filters) == 1:
+            return filters[0].process(audio_data, out)
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(filters)))) as executor:
+            futures = [executor.submit(filters[channel].process, audio_data[channel:channel + 1], out[channel:channel + 1])
+                       for channel in range(audio_data.shape[0])]
+            for future in futures:
+                future.result()
+        return out
+
+    def step_frequency(self, step, settings):
+        # a track climbs the ladder once, live playback (a looped track) goes round and round
+        return settings["start_freq"] + (step % settings["num_steps"]) * settings["bandwidth"]
+
+    def process_audio(self, audio_data, sample_rate, out=None, progress=None, metrics=None):
+        # The track is rendered a chunk of whole steps at a time, so only out has to be full length.
+        # Pass np.memmap arrays as audio_data and out to keep multi-hour renders on disk.
+        # The ladder is climbed once, after the last rung only the dry part of the mix is left.
+        # progress(done, total) is called with sample counts after every chunk, it may raise to stop the render.
+        # metrics (a RenderMetrics) gets the design, filter, synth, mix and normalize times.
+        # With normalize on, the peak (and loudness) is measured chunk by chunk as out is filled, and
+        # the gain is applied to out in place afterwards; self.levels has what was measured.
+        metrics = metrics or RenderMetrics(sample_rate)
+        settings = self.get_ladder_settings(sample_rate)
         self.raw_in = audio_data
         self.sample_rate = sample_rate
-        
-        start_freq = self.get_value("start_freq")
-        end_freq = self.get_value("end_freq")
-        bandwidth = self.get_value("bandwidth")
-        step_duration = self.get_value("step_duration")
-        beep_duration = self.get_value("beep_duration")
-        q_factor = self.get_value("q_factor")
-        filter_mix_ratio = self.get_value("filter_mix_ratio")
-        beep_mix_ratio = self.get_value("beep_mix_ratio")
-
-        num_steps = int((end_freq - start_freq) / bandwidth)
-        step_samples = int(step_duration * sample_rate)
-        beep_samples = int(beep_duration * sample_rate)
-
-        filtered_audio = np.zeros_like(audio_data)
-        beep_audio = np.zeros_like(audio_data)
-
-        for i in range(num_steps):
-            freq = start_freq + i * bandwidth
-            start_sample = i * step_samples
-            end_sample = min((i + 1) * step_samples, audio_data.shape[1])
-
-            filtered_chunk = self.apply_notch_filter(audio_data[:, start_sample:end_sample], freq, q_factor, sample_rate)
-            filtered_audio[:, start_sample:end_sample] = filtered_chunk
-
-            beep = self.generate_alternating_stereo_beep(freq, beep_duration, sample_rate, i % 2 == 0)
-            beep_start = start_sample
-            beep_end = min(beep_start + beep_samples, audio_data.shape[1])
-            beep_audio[:, beep_start:beep_end] += beep[:, :beep_end-beep_start]
-
-        self.raw_out = (1 - filter_mix_ratio - beep_mix_ratio) * audio_data + \
-                       filter_mix_ratio * filtered_audio + \
-                       beep_mix_ratio * beep_audio
+        if out is None:
+            out = np.empty(audio_data.shape, dtype=settings["dtype"])
+
+        step_samples = settings["step_samples"]
+        beep_samples = settings["beep_samples"]
+        filter_mix_ratio = settings["filter_mix_ratio"]
+        beep_mix_ratio = settings["beep_mix_ratio"]
+        dry_ratio = 1 - filter_mix_ratio - beep_mix_ratio
+
+        with metrics.stage("design"):
+            schedule = build_ladder_schedule(audio_data.shape[1], step_samples, self.ladder_frequencies(settings),
+                                             repeat=False)
+            # every rung the track gets to is designed here, not on its first step in the filter stage
+            frequencies = schedule.frequencies[np.unique(schedule.rungs)]
+            design = continuous = spectral = None
+            if settings["engine"] == "fft":
+                spectral = self.spectral_filter(settings, sample_rate)
+            elif settings["filter_mode"] == "continuous":
+                continuous = self.continuous_filters(settings, sample_rate, audio_data.shape[0], frequencies)
+            else:
+                design = self.notch_design(settings, sample_rate, frequencies=frequencies)
+        if spectral is not None:
+            # frames reach past the chunk edges, so the FFT engine reads from the converted track
+            with metrics.stage("filter"):
+                audio_data = to_internal(audio_data, settings["dtype"])
 
+        meter = None
+        if settings["normalize"] != "off":
+            meter = LevelMeter(out.shape[0], sample_rate, loudness=settings["normalize"] == "loudness")
+
+        # a beep longer than a step rings on into the next steps, and past the end of its chunk:
+        # what sticks out is carried into the next chunk
+        carry = np.zeros((out.shape[0], beep_samples), dtype=settings["dtype"])
+        for cols, chunk_schedule in self.render_chunks(schedule, audio_data.shape[1], step_samples):
+            with metrics.stage("filter"):
+                chunk = to_internal(audio_data[:, cols], settings["dtype"])
+                filtered_chunk = None  # past the ladder
+                if chunk_schedule is not None:
+                    filtered_chunk = np.empty_like(chunk)
+                    if spectral is not None:
+                        spectral.process(audio_data, cols.start, cols.stop, filtered_chunk)
+                    elif continuous is not None:
+                        self.filter_continuous(chunk, filtered_chunk, continuous, settings["num_threads"])
+                    else:
+                        filter_steps_threaded(chunk, chunk_schedule, design, filtered_chunk,
+                                              threads=settings["num_threads"])
+
+            with metrics.stage("synth"):
+                chunk_samples = chunk.shape[1]
+                beep_chunk = np.zeros((chunk.shape[0], chunk_samples + beep_samples), dtype=chunk.dtype)
+                beep_chunk[:, :beep_samples] += carry
+                if chunk_schedule is not None:
+                    render_beeps(chunk_schedule, beep_samples, sample_rate, beep_chunk)
+                carry = beep_chunk[:, chunk_samples:]
+                beep_chunk = beep_chunk[:, :chunk_samples]
+
+            with metrics.stage("mix"):
+                if filtered_chunk is None:
+                    out[:, cols] = dry_ratio * chunk + beep_mix_ratio * beep_chunk
+                else:
+                    out[:, cols] = dry_ratio * chunk + filter_mix_ratio * filtered_chunk + beep_mix_ratio * beep_chunk
+            if meter is not None:
+                with metrics.stage("normalize"):
+                    meter.update(out[:, cols])
+            if progress is not None:
+                progress(cols.stop, audio_data.shape[1])
+
+        if meter is not None:
+            with metrics.stage("normalize"):
+                self.levels = self.normalize(out, meter, settings)
+        metrics.count(audio_data.shape[1], sample_rate)
+        self.raw_out = out
         return self.raw_out
 
+    def render_chunks(self, schedule, total_samples, step_samples):
+        # (columns, schedule of the steps in them) of about render_chunk_samples each, whole steps
+        # while the ladder lasts and (columns, None) for the rest of the track
+        chunk_steps = max(1, self.render_chunk_samples // step_samples)
+        for first in range(0, len(schedule), chunk_steps):
+            last = min(first + chunk_steps, len(schedule))
+            yield slice(int(schedule.starts[first]), int(schedule.ends[last - 1])), schedule.slice(first, last)
+        ladder_end = int(schedule.ends[-1]) if len(schedule) else 0
+        for start in range(ladder_end, total_samples, self.render_chunk_samples):
+            yield slice(start, min(start + self.render_chunk_samples, total_samples)), None
+
+    def normalize(self, out, meter, settings):
+        # one gain for both channels, so the beeps stay where they are in the stereo image
+        lufs = meter.integrated_loudness()
+        if settings["normalize"] == "loudness":
+            gain = loudness_gain(lufs, settings["target_lufs"], meter.peak, settings["target_peak"])
+        else:
+            gain = float(peak_gain(meter.peak, settings["target_peak"]))
+        apply_gain(out, gain)
+        return {"peak": meter.peak, "lufs": lufs, "gain": gain}
+
+    def process_stream(self, blocks, sample_rate):
+        # Streaming version of process_audio. Blocks are (channels, samples) arrays of any size,
+        # the notch filter state (zi) and the ladder position are carried from block to block,
+        # so memory use is one block regardless of the track length.
+        # filtfilt needs a whole step up front, so this path filters causally: stepwise mode restarts
+        # the notch every step like process_audio does, continuous mode carries the state over.
+        # Like process_audio it climbs the ladder once, after that only the dry part is left.
+        self.sample_rate = sample_rate
+        settings = self.get_ladder_settings(sample_rate)
+        if settings["engine"] == "fft":
+            raise ValueError("The fft engine works on whole tracks only, use process_audio.")
+        step_samples = settings["step_samples"]
+        beep_samples = settings["beep_samples"]
+        filter_mix_ratio = settings["filter_mix_ratio"]
+        beep_mix_ratio = settings["beep_mix_ratio"]
+        dry_ratio = 1 - filter_mix_ratio - beep_mix_ratio
+        design = self.notch_design(settings, sample_rate)
+        continuous = self.continuous_filter(settings, sample_rate) if settings["filter_mode"] == "continuous" else None
+        beep_bank = BeepBank([self.step_frequency(step, settings) for step in range(settings["num_steps"])],
+                             beep_samples, sample_rate)
+
+        ladder_end = settings["num_steps"] * step_samples
+        position = 0
+        current_step = -1
+        b = a = zi = None
+        for block in blocks:
+            block = to_internal(block, settings["dtype"])
+            channels, block_samples = block.shape
+            filtered = np.empty_like(block)
+            beeps = np.zeros_like(block)
+            ladder_samples = min(max(ladder_end - position, 0), block_samples)
+
+            offset = 0
+            while offset < ladder_samples:
+                step, step_pos = divmod(position + offset, step_samples)
+                length = min(step_samples - step_pos, ladder_samples - offset)
+                freq = self.step_frequency(step, settings)
+                if continuous is None and step != current_step:
+                    # new rung: new notch and a fresh filter state, same as filtering each step on its own
+                    b, a = design(freq)
+                    zi = np.zeros((channels, len(a) - 1), dtype=block.dtype)
+                    current_step = step
+
+                chunk = slice(offset, offset + length)
+                if continuous is None:
+                    filtered[:, chunk], zi = lfilter(b, a, block[:, chunk], axis=1, zi=zi)
+
+                offset += length
+
+            # beeps go on past their step (and the ladder) when they are longer than a step,
+            # so every step whose beep reaches into this block adds its part
+            first_step = max(0, (position - beep_samples) // step_samples)
+            last_step = min(settings["num_steps"], -(-(position + block_samples) // step_samples))
+            for step in range(first_step, last_step):
+                beep_start = step * step_samples - position
+                start = max(beep_start, 0)
+                end = min(beep_start + beep_samples, block_samples)
+                if start < end:
+                    channel = min(step % 2, channels - 1)
+                    beep_bank.write(step, beeps[channel, start:end], start - beep_start, add=True)
+
+            if continuous is not None:
+                continuous.process(block, filtered)
+            filtered[:, ladder_samples:] = 0
+            position += block_samples
+            yield dry_ratio * block + filter_mix_ratio * filtered + beep_mix_ratio * beeps
+
+    def live_design(self, sample_rate, block_size):
+        # the current parameters for a LiveLadder, see live_ladder.py. Steps are rounded to whole blocks.
+        settings = self.get_ladder_settings(sample_rate)
+        if settings["engine"] == "fft":
+            raise ValueError("The fft engine works on whole tracks only, live playback needs the iir engine.")
+        frequencies = [self.step_frequency(step, settings) for step in range(settings["num_steps"])]
+        return LadderDesign(frequencies, settings["step_samples"], settings["beep_samples"],
+                            self.notch_design(settings, sample_rate), sample_rate, block_size,
+                            settings["filter_mix_ratio"], settings["beep_mix_ratio"],
+                            settings["filter_mode"] == "continuous", settings["dtype"])
+
+    def live_processor(self, sample_rate, block_size, channels=2):
+        # process_stream for a real time callback: fixed size (frames, channels) blocks, filtered in place
+        # without allocating. Parameter changes while it runs: processor.publish(self.live_design(...))
+        return LiveLadder(self.live_design(sample_rate, block_size), channels)
+
     def get_info(self):
         info = {
             "name": self.get_translation("name"),
@@ -108,20 +393,29 @@ class TinnitusFilter:
         return self.get_translation(f"{param_name}_description")
 
     def adjust_parameter(self, param_name, value):
-        if param_name in self.default_values:
-            self.custom_values[param_name] = value
-        else:
-            raise ValueError(f"Invalid parameter name: {param_name}")
+        # validated before anything changes, a bad value leaves the filter as it was
+        self.adjust_parameters({param_name: value})
+
+    def adjust_parameters(self, values):
+        # all at once, so e.g. moving start_freq and end_freq up together doesn't trip over end < start
+        parameters = self.get_parameters().replace(**values)
+        for param_name in values:
+            self.custom_values[param_name] = getattr(parameters, param_name)
+        self.parameters = parameters
 
     def save_custom_values(self, file_path):
         with open(file_path, 'w') as file:
             json.dump(self.custom_values, file, indent=4)
 
-    def execute(self):
+    def execute(self, out=None, progress=None, metrics=None):
         if self.raw_in is None or self.sample_rate is None:
             raise ValueError("Input audio data and sample rate must be set before execution.")
-        return self.process_audio(self.raw_in, self.sample_rate)
+        return self.process_audio(self.raw_in, self.sample_rate, out, progress, metrics)
 
     def set_input(self, raw_in, sample_rate):
         self.raw_in = raw_in
         self.sample_rate = sample_rate
+
+
+# FilterManager looks up the class named after the filter folder
+Ladder2 = TinnitusFilter
@@ -3,9 +3,16 @@
 # the code below needs to be reviewed (2024-08-29)
 
 import json
+import os
+import sys
 import numpy as np
 from scipy.signal import iirnotch, filtfilt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from filters.common.instrumentation import ProgressReporter
+from filters.common.loudness import apply_gain, measure_levels, peak_gain
+
 
 
 
@@ -158,6 +165,7 @@ class TinnitusFilter:
             filtered_data = np.zeros_like(data)
             current_freq = start_freq
             left_channel = True  # Start with left channel
+            progress = ProgressReporter("Applying beeps and notch filters", sample_rate=sample_rate)
             for i in range(0, data.shape[1], samples_per_step):
                 # Generate and mix in the stereo beep
                 stereo_beep = self.generate_alternating_stereo_beep(current_freq, beep_duration, sample_rate, left_channel)
@@ -171,7 +179,7 @@ class TinnitusFilter:
                 mixed_filtered = (1 - filter_mix_ratio) * chunk_to_filter + filter_mix_ratio * filtered_chunk
                 filtered_data[:, i+beep_samples:i+samples_per_step] = mixed_filtered
 
-                print(f"Applied stereo beep and notch filter at {current_freq:.0f} Hz for {i/sample_rate:.1f}-{(i+samples_per_step)/sample_rate:.1f}s")
+                progress(min(i + samples_per_step, data.shape[1]), data.shape[1])
 
                 # Move to next frequency step
                 current_freq += bandwidth
@@ -182,7 +190,7 @@ class TinnitusFilter:
                 left_channel = not left_channel
 
             # Normalize the filtered data
-            self.raw_out = filtered_data / np.max(np.abs(filtered_data))
+            self.raw_out = apply_gain(filtered_data, peak_gain(measure_levels(filtered_data).peak))
 
         except Exception as e:
             print(f"An error occurred: {str(e)}")
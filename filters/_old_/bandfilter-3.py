@@ -1,12 +1,18 @@
 import numpy as np
-import librosa
 import soundfile as sf
-from scipy.signal import iirnotch, filtfilt
+from scipy.signal import filtfilt
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from disk_cache import load_audio
+from filters.common.instrumentation import ProgressReporter
+from filters.common.loudness import apply_gain, measure_levels, peak_gain
+from filters.common.notch_cache import iirnotch_coefficients
 
 def apply_notch_filter(data, freq, q, fs):
-    nyq = 0.5 * fs
-    freq_normalized = freq / nyq
-    b, a = iirnotch(freq_normalized, q)
+    b, a = iirnotch_coefficients(freq, q, fs)
     filtered_data = filtfilt(b, a, data)
     return filtered_data
 
@@ -18,7 +24,7 @@ def create_ladder_notched_music(input_file, output_file, start_freq, end_freq, b
         
         # Load the audio file
         print("Loading audio file...")
-        data, sample_rate = librosa.load(input_file, sr=None)
+        data, sample_rate = load_audio(input_file)
         duration = len(data) / sample_rate
         print(f"Audio loaded. Duration: {duration:.2f} seconds, Sample rate: {sample_rate} Hz")
         
@@ -28,6 +34,7 @@ def create_ladder_notched_music(input_file, output_file, start_freq, end_freq, b
         # Process audio in steps
         filtered_data = np.zeros_like(data)
         current_freq = start_freq
+        progress = ProgressReporter("Applying notch filters", sample_rate=sample_rate)
         for i in range(0, len(data), samples_per_step):
             chunk = data[i:i+samples_per_step]
             
@@ -39,7 +46,7 @@ def create_ladder_notched_music(input_file, output_file, start_freq, end_freq, b
             
             filtered_data[i:i+len(mixed_chunk)] = mixed_chunk
             
-            print(f"Applied notch filter at {current_freq:.0f} Hz for {i/sample_rate:.1f}-{(i+samples_per_step)/sample_rate:.1f}s")
+            progress(i + len(mixed_chunk), len(data))
             
             # Move to next frequency step
             current_freq += bandwidth
@@ -47,7 +54,7 @@ def create_ladder_notched_music(input_file, output_file, start_freq, end_freq, b
                 current_freq = start_freq  # Reset to start frequency
         
         # Normalize the filtered data
-        filtered_data = filtered_data / np.max(np.abs(filtered_data))
+        apply_gain(filtered_data, peak_gain(measure_levels(filtered_data).peak))
         
         # Export the filtered audio
         print(f"Saving filtered audio to {output_file}")
@@ -61,8 +68,8 @@ def create_ladder_notched_music(input_file, output_file, start_freq, end_freq, b
         print(f"Unfiltered music saved to {unfiltered_output}")
         
         # Verify output files
-        filtered_duration = librosa.get_duration(filename=output_file)
-        unfiltered_duration = librosa.get_duration(filename=unfiltered_output)
+        filtered_duration = sf.info(output_file).duration
+        unfiltered_duration = sf.info(unfiltered_output).duration
         print(f"Filtered audio duration: {filtered_duration:.2f} seconds")
         print(f"Unfiltered audio duration: {unfiltered_duration:.2f} seconds")
         
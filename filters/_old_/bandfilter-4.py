@@ -1,27 +1,14 @@
 import numpy as np
-import librosa
 import soundfile as sf
-from scipy.signal import iirnotch, filtfilt
 import os
+import sys
 
-def apply_notch_filter(data, freq, q, fs):
-    nyq = 0.5 * fs
-    freq_normalized = freq / nyq
-    b, a = iirnotch(freq_normalized, q)
-    filtered_data = filtfilt(b, a, data)
-    return filtered_data
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 
-def generate_alternating_stereo_beep(freq, duration, sample_rate, left_channel):
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    beep = np.sin(2 * np.pi * freq * t)
-    stereo_beep = np.zeros((len(beep), 2))
-    if left_channel:
-        stereo_beep[:, 0] = beep  # Left channel
-        print(f"Beep at {freq:.0f} Hz in Left channel")
-    else:
-        stereo_beep[:, 1] = beep  # Right channel
-        print(f"Beep at {freq:.0f} Hz in Right channel")
-    return stereo_beep
+from disk_cache import load_audio
+from filters.common.ladder import build_ladder_schedule, filter_steps, ladder_frequencies, render_beeps
+from filters.common.loudness import apply_gain, measure_levels, peak_gain
+from filters.common.notch_cache import iirnotch_coefficients
 
 def create_ladder_notched_music_with_stereo_beeps(input_file, output_dir, start_freq, end_freq, bandwidth, step_duration, beep_duration=0.1, q_factor=30, filter_mix_ratio=0.7, beep_mix_ratio=0.4):
     try:
@@ -31,7 +18,7 @@ def create_ladder_notched_music_with_stereo_beeps(input_file, output_dir, start_
         
         # Load the audio file
         print("Loading audio file...")
-        data, sample_rate = librosa.load(input_file, sr=None, mono=False)
+        data, sample_rate = load_audio(input_file, mono=False)
         if data.ndim == 1:
             data = np.stack([data, data])  # Convert mono to stereo
         duration = data.shape[1] / sample_rate
@@ -42,35 +29,25 @@ def create_ladder_notched_music_with_stereo_beeps(input_file, output_dir, start_
         beep_samples = int(beep_duration * sample_rate)
         filter_samples = samples_per_step - beep_samples
         
-        # Process audio in steps
-        filtered_data = np.zeros_like(data)
-        current_freq = start_freq
-        left_channel = True  # Start with left channel
-        for i in range(0, data.shape[1], samples_per_step):
-            # Generate and mix in the stereo beep
-            stereo_beep = generate_alternating_stereo_beep(current_freq, beep_duration, sample_rate, left_channel)
-            chunk_with_beep = data[:, i:i+beep_samples]
-            mixed_beep = (1 - beep_mix_ratio) * chunk_with_beep + beep_mix_ratio * stereo_beep.T
-            filtered_data[:, i:i+beep_samples] = mixed_beep
-            
-            # Apply notch filter to the remaining part of the chunk
-            chunk_to_filter = data[:, i+beep_samples:i+samples_per_step]
-            filtered_chunk = apply_notch_filter(chunk_to_filter, current_freq, q_factor, sample_rate)
-            mixed_filtered = (1 - filter_mix_ratio) * chunk_to_filter + filter_mix_ratio * filtered_chunk
-            filtered_data[:, i+beep_samples:i+samples_per_step] = mixed_filtered
-            
-            print(f"Applied stereo beep and notch filter at {current_freq:.0f} Hz for {i/sample_rate:.1f}-{(i+samples_per_step)/sample_rate:.1f}s")
-            
-            # Move to next frequency step
-            current_freq += bandwidth
-            if current_freq > end_freq:
-                current_freq = start_freq  # Reset to start frequency
-            
-            # Alternate between left and right channels
-            left_channel = not left_channel
+        # Lay out the whole ladder up front, the frequency climbs a rung per step and starts over past end_freq
+        schedule = build_ladder_schedule(data.shape[1], samples_per_step,
+                                         ladder_frequencies(start_freq, end_freq, bandwidth, include_end=True))
+        print(f"Ladder: {len(schedule)} steps over {len(schedule.frequencies)} frequencies, beeps alternate left/right")
+
+        # Apply notch filter to the part of each step after the beep
+        notched = np.zeros_like(data)
+        filter_steps(data, schedule, lambda freq: iirnotch_coefficients(freq, q_factor, sample_rate), notched, skip=beep_samples)
+        filtered_data = (1 - filter_mix_ratio) * data + filter_mix_ratio * notched
+
+        # Mix the stereo beeps into the start of each step
+        beeps = np.zeros_like(data)
+        render_beeps(schedule, beep_samples, sample_rate, beeps)
+        in_beep = (np.arange(data.shape[1]) % samples_per_step) < beep_samples
+        filtered_data[:, in_beep] = (1 - beep_mix_ratio) * data[:, in_beep] + beep_mix_ratio * beeps[:, in_beep]
+        print(f"Applied stereo beeps and notch filters for {len(schedule)} steps")
         
         # Normalize the filtered data
-        filtered_data = filtered_data / np.max(np.abs(filtered_data))
+        apply_gain(filtered_data, peak_gain(measure_levels(filtered_data).peak))
         
         # Generate output filename
         input_filename = os.path.basename(input_file)
@@ -84,7 +61,7 @@ def create_ladder_notched_music_with_stereo_beeps(input_file, output_dir, start_
         print(f"Ladder notched music with alternating stereo beeps saved to {output_file}")
         
         # Verify output file
-        filtered_duration = librosa.get_duration(filename=output_file)
+        filtered_duration = sf.info(output_file).duration
         print(f"Filtered audio duration: {filtered_duration:.2f} seconds")
         
     except Exception as e:
@@ -102,5 +79,6 @@ q_factor = 30
 filter_mix_ratio = 0.1  # 10% original, 90% filtered for the main audio
 beep_mix_ratio = 0.4  # 60% original, 40% beep for the beep sound
 
-create_ladder_notched_music_with_stereo_beeps(input_file, output_dir, start_freq, end_freq, bandwidth, step_duration, 
-                                              beep_duration, q_factor, filter_mix_ratio, beep_mix_ratio)
\ No newline at end of file
+if __name__ == "__main__":
+    create_ladder_notched_music_with_stereo_beeps(input_file, output_dir, start_freq, end_freq, bandwidth, step_duration, 
+                                                  beep_duration, q_factor, filter_mix_ratio, beep_mix_ratio)
\ No newline at end of file
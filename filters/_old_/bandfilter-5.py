@@ -1,142 +1,78 @@
 import numpy as np
-import librosa
 import soundfile as sf
-from scipy.signal import butter, filtfilt, chirp
+from scipy.signal import butter
 import os
+import sys
 import traceback
-import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from disk_cache import load_audio
+from filters.common.ladder import build_ladder_schedule, ladder_frequencies
+from filters.common.loudness import LevelMeter, apply_gain, measure_levels, peak_gain
+from filters.common.notch_cache import bandstop_coefficients
+from filters.common.oscillator import FmOscillator
+from filters.common.treatment_graph import (LadderStage, NoiseStage, Signal, SignalStage, ToneStage, TreatmentGraph,
+                                            ZeroPhaseFilterStage)
+
+# samples of look-around for the zero-phase filters, far longer than any of them rings
+FILTER_CONTEXT_SECONDS = 0.25
 
 def create_notch_filter(center_freq, q, fs):
-    bandwidth = center_freq / q
-    low = center_freq - bandwidth / 2
-    high = center_freq + bandwidth / 2
-    nyq = 0.5 * fs
-    low = low / nyq
-    high = high / nyq
-    low = max(0.0, min(low, 1.0))
-    high = max(0.0, min(high, 1.0))
-    b, a = butter(2, [low, high], btype='bandstop', analog=False, output='ba')
-    return b, a
-
-def apply_notch_filter(data, center_freq, q, fs):
-    b, a = create_notch_filter(center_freq, q, fs)
-    return filtfilt(b, a, data)
-
-def generate_am_tone(freq, duration, sample_rate, mod_freq):
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    carrier = np.sin(2 * np.pi * freq * t)
-    modulator = 0.5 * (1 + np.sin(2 * np.pi * mod_freq * t))
-    return carrier * modulator
-
-def generate_fm_tone(freq, duration, sample_rate, mod_freq, mod_index):
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    return np.sin(2 * np.pi * freq * t + mod_index * np.sin(2 * np.pi * mod_freq * t))
-
-def generate_tinnitus_matched_noise(duration, sample_rate, center_freq, bandwidth):
-    noise = np.random.normal(0, 1, int(duration * sample_rate))
-    nyq = 0.5 * sample_rate
-    low = (center_freq - bandwidth/2) / nyq
-    high = (center_freq + bandwidth/2) / nyq
-    b, a = butter(4, [low, high], btype='band')
-    filtered_noise = filtfilt(b, a, noise)
-    return filtered_noise
-
-def generate_ladder_pattern(data, start_freq, end_freq, bandwidth, step_duration, sample_rate, beep_duration):
-    filtered_data = np.zeros_like(data)
-    current_freq = start_freq
-    samples_per_step = int(step_duration * sample_rate)
-    beep_samples = int(beep_duration * sample_rate)
-    
-    for i in range(0, data.shape[1], samples_per_step):
-        t = np.linspace(0, beep_duration, beep_samples, False)
-        beep = np.sin(2 * np.pi * current_freq * t)
-        stereo_beep = np.zeros((2, beep_samples))
-        
-        if random.choice([True, False]):
-            stereo_beep[0, :] = beep  # Left channel
-        else:
-            stereo_beep[1, :] = beep  # Right channel
-        
-        chunk_with_beep = data[:, i:i+beep_samples]
-        if chunk_with_beep.shape[1] < beep_samples:
-            padding = np.zeros((2, beep_samples - chunk_with_beep.shape[1]))
-            chunk_with_beep = np.hstack((chunk_with_beep, padding))
-        
-        mixed_beep = 0.7 * chunk_with_beep + 0.3 * stereo_beep
-        filtered_data[:, i:i+beep_samples] = mixed_beep
-        
-        chunk_to_filter = data[:, i+beep_samples:i+samples_per_step]
-        if chunk_to_filter.shape[1] > 0:
-            filtered_chunk = np.vstack((
-                apply_notch_filter(chunk_to_filter[0], current_freq, 30, sample_rate),
-                apply_notch_filter(chunk_to_filter[1], current_freq, 30, sample_rate)
-            ))
-            filtered_data[:, i+beep_samples:i+samples_per_step] = filtered_chunk
-        
-        current_freq += bandwidth
-        if current_freq > end_freq:
-            current_freq = start_freq
-    
-    return filtered_data
+    return bandstop_coefficients(center_freq, q, fs)
+
+def build_treatment_graph(music, sr, params):
+    # the same five treatments as before, now as stages that render only the segment asked for
+    context = int(FILTER_CONTEXT_SECONDS * sr)
+    total_samples = music.length
+
+    samples_per_step = int(params['ladder_step_duration'] * sr)
+    num_steps = -(-total_samples // samples_per_step)
+    ladder_schedule = build_ladder_schedule(
+        total_samples, samples_per_step,
+        ladder_frequencies(params['ladder_start_freq'], params['ladder_end_freq'], params['ladder_bandwidth'], include_end=True),
+        channels=np.random.randint(0, 2, num_steps))
+
+    nyq = 0.5 * sr
+    low = (params['tinnitus_freq'] - params['noise_bandwidth'] / 2) / nyq
+    high = (params['tinnitus_freq'] + params['noise_bandwidth'] / 2) / nyq
+    noise_b, noise_a = butter(4, [low, high], btype='band')
+
+    freq, mod_freq, mod_index = params['tinnitus_freq'], params['fm_mod_freq'], params['fm_mod_index']
+    stages = {
+        "original": SignalStage(music),
+        "notched": ZeroPhaseFilterStage(music, *create_notch_filter(params['tinnitus_freq'], params['notch_q'], sr), context),
+        "ladder": LadderStage(music, ladder_schedule, lambda step_freq: create_notch_filter(step_freq, 30, sr),
+                              int(params['ladder_beep_duration'] * sr), sr),
+        "fm": ToneStage(FmOscillator(freq, mod_freq, mod_index, sr)),
+        "noise": NoiseStage(noise_b, noise_a, context, seed=np.random.randint(2 ** 31)),
+    }
+    return TreatmentGraph(stages, params['segments'], int(params['segment_duration'] * sr))
 
 def create_dynamic_tinnitus_treatment(input_file, output_dir, params):
     try:
         print(f"Loading audio file: {input_file}")
-        audio, sr = librosa.load(input_file, sr=None, duration=params['duration'], mono=False)
+        audio, sr = load_audio(input_file, mono=False, duration=params['duration'])
         print(f"Audio loaded. Shape: {audio.shape}, Sample rate: {sr}")
 
         if len(audio.shape) == 1:
-            audio = np.expand_dims(audio, axis=0)
-            audio = np.repeat(audio, 2, axis=0)
-        
+            audio = np.broadcast_to(audio, (2, len(audio)))
+
+        # shorter tracks are padded with silence, normalizing is done while reading
         desired_length = int(params['duration'] * sr)
-        if audio.shape[1] < desired_length:
-            padding_length = desired_length - audio.shape[1]
-            padding = np.zeros((2, padding_length))
-            audio = np.hstack((audio, padding))
-        elif audio.shape[1] > desired_length:
-            audio = audio[:, :desired_length]
-        
-        print(f"Audio shape after preprocessing: {audio.shape}")
-        audio = librosa.util.normalize(audio, axis=1)
-
-        notched_music = np.vstack((
-            apply_notch_filter(audio[0], params['tinnitus_freq'], params['notch_q'], sr),
-            apply_notch_filter(audio[1], params['tinnitus_freq'], params['notch_q'], sr)
-        ))
-        
-        ladder_pattern = generate_ladder_pattern(audio, params['ladder_start_freq'], params['ladder_end_freq'],
-                                                 params['ladder_bandwidth'], params['ladder_step_duration'],
-                                                 sr, params['ladder_beep_duration'])
-        
-        fm_tone = generate_fm_tone(params['tinnitus_freq'], params['duration'], sr, params['fm_mod_freq'], params['fm_mod_index'])
-        fm_tone = np.vstack((fm_tone, fm_tone))
-
-        matched_noise = generate_tinnitus_matched_noise(params['duration'], sr, params['tinnitus_freq'], params['noise_bandwidth'])
-        matched_noise = np.vstack((matched_noise, matched_noise))
-
-        treatments = {
-            "original": audio,
-            "notched": notched_music,
-            "ladder": ladder_pattern,
-            "fm": fm_tone,
-            "noise": matched_noise
-        }
-
-        segment_duration = params['segment_duration']  # 4 seconds per segment
-        samples_per_segment = segment_duration * sr
-        mixed_audio = np.zeros_like(audio)
-        
-        for i in range(0, mixed_audio.shape[1], samples_per_segment):
-            segment_index = (i // samples_per_segment) % len(params['segments'])
-            segment_name, segment_mix = params['segments'][segment_index]
-            end_index = min(i + samples_per_segment, mixed_audio.shape[1])
-            
-            segment_audio = sum(treatments[key] * volume for key, volume in segment_mix.items())
-            mixed_audio[:, i:end_index] = segment_audio[:, i:end_index]
-            print(f"Added segment: {segment_name} from {i/sr:.1f}s to {end_index/sr:.1f}s")
-
-        mixed_audio = librosa.util.normalize(mixed_audio, axis=1)
+        music = Signal(audio, length=desired_length, scale=peak_gain(measure_levels(audio).peaks))
+        print(f"Audio shape after preprocessing: {(music.channels, music.length)}")
+
+        graph = build_treatment_graph(music, sr, params)
+        mixed_audio = np.zeros((2, desired_length), dtype=np.float32)
+        # the peaks are taken from every block as it comes out of the graph, normalizing is then one in place pass
+        meter = LevelMeter(2)
+        for segment_name, start, end, block in graph.blocks(desired_length):
+            mixed_audio[:, start:end] = block
+            meter.update(block)
+            print(f"Added segment: {segment_name} from {start/sr:.1f}s to {end/sr:.1f}s")
+
+        apply_gain(mixed_audio, peak_gain(meter.peaks))
 
         output_filename = f"Dynamic_TinnitusFreq_{params['tinnitus_freq']}.wav"
         output_file = os.path.join(output_dir, output_filename)
@@ -174,4 +110,5 @@ params = {
     ]
 }
 
-create_dynamic_tinnitus_treatment(input_file, output_dir, params)
\ No newline at end of file
+if __name__ == "__main__":
+    create_dynamic_tinnitus_treatment(input_file, output_dir, params)
\ No newline at end of file
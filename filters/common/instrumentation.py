@@ -0,0 +1,88 @@
+# instrumentation.py
+
+# Where the time of a render goes. A RenderMetrics is handed down through process_audio and the
+# filter, every stage adds its time to it (decode, design, filter, synth, mix, normalize, encode),
+# and at the end it tells the time per stage and the samples per second. It costs two perf_counter
+# calls per chunk, so it is always on.
+#
+# ProgressReporter replaces printing a line per step: it takes the same progress(done, total) calls
+# as the render code makes, but prints at most once per interval, plus once at the end.
+
+import time
+from contextlib import contextmanager
+
+STAGES = ("decode", "design", "filter", "synth", "mix", "normalize", "encode")
+
+
+class RenderMetrics:
+    def __init__(self, sample_rate=None):
+        self.sample_rate = sample_rate
+        self.samples = 0  # per channel
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def count(self, samples, sample_rate=None):
+        self.samples += samples
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def samples_per_second(self, name=None):
+        seconds = self.total() if name is None else self.seconds.get(name, 0.0)
+        return self.samples / seconds if seconds else float('inf')
+
+    def as_dict(self):
+        return {
+            "samples": self.samples,
+            "sample_rate": self.sample_rate,
+            "seconds": dict(self.seconds),
+            "total_seconds": self.total(),
+            "samples_per_second": self.samples_per_second(),
+        }
+
+    def report(self):
+        total = self.total()
+        names = [name for name in STAGES if name in self.seconds]
+        names += [name for name in self.seconds if name not in STAGES]
+        lines = [f"{name:>8}: {self.seconds[name]:8.3f} s {self.seconds[name] / total if total else 0:6.1%}"
+                 for name in names]
+        summary = f"   total: {total:8.3f} s, {self.samples_per_second() / 1e6:.2f} M samples/s"
+        if self.sample_rate and total:
+            summary += f" ({self.samples / self.sample_rate / total:.1f}x realtime)"
+        return "\n".join(lines + [summary])
+
+
+class ProgressReporter:
+    # progress(done, total) with sample counts (or steps, anything that counts up to total)
+    def __init__(self, label="Processing", interval=1.0, sample_rate=None, out=print):
+        self.label = label
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.out = out
+        self.start = time.perf_counter()
+        self.last = None
+
+    def __call__(self, done, total):
+        now = time.perf_counter()
+        if done < total and self.last is not None and now - self.last < self.interval:
+            return
+        self.last = now
+        message = f"{self.label}: {done / total if total else 1:6.1%}"
+        if self.sample_rate:
+            elapsed = now - self.start
+            message += f", {done / self.sample_rate:.1f} s of audio"
+            if elapsed:
+                message += f" ({done / self.sample_rate / elapsed:.1f}x realtime)"
+        self.out(message)
@@ -0,0 +1,234 @@
+# ladder.py
+
+# Shared ladder helpers. Instead of walking the track one step at a time in Python,
+# the whole ladder is laid out up front as arrays (start, end, frequency, channel per step),
+# beeps are rendered in one go and steps that share a rung are filtered together.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.signal import filtfilt, lfilter, lfilter_zi, sosfilt
+
+from filters.common.oscillator import BeepBank
+
+
+class LadderSchedule:
+    def __init__(self, starts, ends, rungs, channels, frequencies):
+        self.starts = starts
+        self.ends = ends
+        self.rungs = rungs
+        self.channels = channels
+        self.frequencies = frequencies
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def step_frequencies(self):
+        return self.frequencies[self.rungs]
+
+    def slice(self, first, last):
+        # steps first..last-1 as a schedule of their own, sample positions relative to the first step
+        offset = self.starts[first]
+        return LadderSchedule(self.starts[first:last] - offset, self.ends[first:last] - offset,
+                              self.rungs[first:last], self.channels[first:last], self.frequencies)
+
+
+def ladder_frequencies(start_freq, end_freq, bandwidth, include_end=False):
+    # Ladder2 uses int((end - start) / bandwidth) rungs, the old scripts keep climbing up to and including end_freq
+    num_steps = int((end_freq - start_freq) / bandwidth)
+    if include_end:
+        num_steps += 1
+    return start_freq + np.arange(max(1, num_steps)) * bandwidth
+
+
+def build_ladder_schedule(total_samples, step_samples, frequencies, channels=None, repeat=True):
+    # channels: None alternates left/right starting left, otherwise an array with a channel per step
+    # repeat: the old scripts start over at the first rung until the track ends, Ladder2 climbs once
+    frequencies = np.asarray(frequencies, dtype=float)
+    num_steps = -(-total_samples // step_samples)
+    if not repeat:
+        num_steps = min(num_steps, len(frequencies))
+    steps = np.arange(num_steps)
+    starts = steps * step_samples
+    ends = np.minimum(starts + step_samples, total_samples)
+    rungs = steps % len(frequencies)
+    if channels is None:
+        channels = steps % 2
+    return LadderSchedule(starts, ends, rungs, np.asarray(channels), frequencies)
+
+
+def render_beeps(schedule, beep_samples, sample_rate, out, gain=1.0, batch_steps=4096):
+    # One beep per rung is enough, every step just copies its rung's beep into place.
+    if beep_samples <= 0 or len(schedule) == 0:
+        return out
+    table = BeepBank(schedule.frequencies, beep_samples, sample_rate, gain).table
+    offsets = np.arange(beep_samples)
+    total_samples = out.shape[1]
+    last_channel = out.shape[0] - 1
+    overlapping = beep_samples > int(schedule.ends[0] - schedule.starts[0])
+
+    for first in range(0, len(schedule), batch_steps):
+        batch = slice(first, first + batch_steps)
+        cols = schedule.starts[batch, None] + offsets[None, :]
+        rows = np.broadcast_to(np.minimum(schedule.channels[batch], last_channel)[:, None], cols.shape)
+        values = table[schedule.rungs[batch]]
+        valid = cols < total_samples
+        if overlapping:
+            np.add.at(out, (rows[valid], cols[valid]), values[valid])
+        else:
+            out[rows[valid], cols[valid]] += values[valid]
+    return out
+
+
+def filtfilt_safe(b, a, data, axis=-1):
+    # filtfilt refuses chunks shorter than its default padding, the tail of a track often is
+    padlen = 3 * max(len(a), len(b))
+    length = data.shape[axis]
+    if length < 2:
+        return np.array(data, copy=True)
+    return filtfilt(b, a, data, axis=axis, padlen=min(padlen, length - 1))
+
+
+def filtfilt_into(b, a, data, out):
+    # filtfilt(b, a, data) along the last axis into out, the same numbers as scipy's. filtfilt copies
+    # data into an odd extended array, and the caller gathers the steps before and scatters them after;
+    # here the padding is filtered on its own and its end state handed to the filter over data itself
+    # (which may be a strided view), so the only full length copies are lfilter's results.
+    length = data.shape[-1]
+    padlen = 3 * max(len(a), len(b))
+    if length <= padlen:
+        out[...] = filtfilt_safe(b, a, data)
+        return out
+    # odd extension, as scipy's odd_ext
+    left = 2 * data[..., :1] - data[..., padlen:0:-1]
+    right = 2 * data[..., -1:] - data[..., -2:-padlen - 2:-1]
+    zi = lfilter_zi(b, a)
+    _, state = lfilter(b, a, left, zi=zi * left[..., :1])
+    forward, state = lfilter(b, a, data, zi=state)
+    right, _ = lfilter(b, a, right, zi=state)
+    _, state = lfilter(b, a, right[..., ::-1], zi=zi * right[..., -1:])
+    out[...] = lfilter(b, a, forward[..., ::-1], zi=state)[0][..., ::-1]
+    return out
+
+
+def filter_steps(data, schedule, design_filter, out, skip=0):
+    # Applies filtfilt per step like the old loops did, but all full-length steps on the same rung
+    # go through scipy as one (channels, steps, samples) array. skip leaves the first samples of
+    # every step untouched (the old scripts put the beep there).
+    # design_filter(freq) -> (b, a)
+    step_samples = int(schedule.ends[0] - schedule.starts[0]) if len(schedule) else 0
+    if step_samples <= skip:
+        return out
+    channels, total_samples = data.shape
+    full_steps = total_samples // step_samples
+    full = data[:, :full_steps * step_samples].reshape(channels, full_steps, step_samples)
+    full_out = out[:, :full_steps * step_samples].reshape(channels, full_steps, step_samples)
+
+    for rung, freq in enumerate(schedule.frequencies):
+        b, a = design_filter(freq)
+        steps = np.flatnonzero(schedule.rungs[:full_steps] == rung)
+        if len(steps) == 0:
+            continue
+        stride = int(steps[1] - steps[0]) if len(steps) > 1 else 1
+        if np.all(np.diff(steps) == stride):
+            # a repeating ladder visits a rung every so many steps: a strided view, no gathering
+            steps = slice(int(steps[0]), int(steps[-1]) + 1, stride)
+            filtfilt_into(b, a, full[:, steps, skip:], full_out[:, steps, skip:])
+        else:
+            full_out[:, steps, skip:] = filtfilt_into(b, a, full[:, steps, skip:],
+                                                      np.empty_like(full_out[:, steps, skip:]))
+
+    if full_steps < len(schedule):
+        start = int(schedule.starts[-1]) + skip
+        if start < total_samples:
+            b, a = design_filter(schedule.frequencies[schedule.rungs[-1]])
+            out[:, start:] = filtfilt_safe(b, a, data[:, start:])
+    return out
+
+
+def filter_steps_threaded(data, schedule, design_filter, out, skip=0, threads=1):
+    # filter_steps split over channels and over runs of whole steps. Steps are filtered independently,
+    # so the result is exactly the same as the single threaded call. SciPy releases the GIL while filtering.
+    channels = data.shape[0]
+    if threads <= 1 or len(schedule) == 0:
+        return filter_steps(data, schedule, design_filter, out, skip)
+
+    segments = min(len(schedule), -(-threads // channels))
+    bounds = np.linspace(0, len(schedule), segments + 1).astype(int)
+    tasks = []
+    for channel in range(channels):
+        rows = slice(channel, channel + 1)
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if first == last:
+                continue
+            cols = slice(int(schedule.starts[first]), int(schedule.ends[last - 1]))
+            tasks.append((data[rows, cols], schedule.slice(first, last), out[rows, cols]))
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(filter_steps, part, part_schedule, design_filter, part_out, skip)
+                   for part, part_schedule, part_out in tasks]
+        for future in futures:
+            future.result()
+    return out
+
+
+class ContinuousLadderFilter:
+    # Causal ladder filtering in one linear pass. The filter state is handed from step to step
+    # instead of restarting the filter at every step boundary, which is where the clicks came from.
+    # With crossfade_samples the outgoing rung keeps running for a moment and is faded into the new one.
+    # Blocks can be any size, position and state carry over between process() calls.
+    # design_sos(freq) -> sos
+
+    def __init__(self, frequencies, step_samples, design_sos, crossfade_samples=0):
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        self.step_samples = step_samples
+        self.design_sos = design_sos
+        self.crossfade_samples = crossfade_samples
+        self.position = 0
+        self.step = -1
+        self.sos = None
+        self.zi = None
+        self.previous_sos = None
+        self.previous_zi = None
+
+    def process(self, block, out=None):
+        channels, block_samples = block.shape
+        if out is None:
+            out = np.empty(block.shape, dtype=np.result_type(block.dtype, float))
+
+        offset = 0
+        while offset < block_samples:
+            step, step_pos = divmod(self.position + offset, self.step_samples)
+            length = min(self.step_samples - step_pos, block_samples - offset)
+            if step != self.step:
+                self._enter_step(step, channels)
+
+            fade_length = 0
+            if self.previous_sos is not None and step_pos < self.crossfade_samples:
+                fade_length = min(self.crossfade_samples - step_pos, length)
+                fade = slice(offset, offset + fade_length)
+                old, self.previous_zi = sosfilt(self.previous_sos, block[:, fade], zi=self.previous_zi)
+                new, self.zi = sosfilt(self.sos, block[:, fade], zi=self.zi)
+                weight = (step_pos + np.arange(1, fade_length + 1)) / (self.crossfade_samples + 1)
+                out[:, fade] = (1 - weight) * old + weight * new
+                if step_pos + fade_length >= self.crossfade_samples:
+                    self.previous_sos = self.previous_zi = None
+
+            rest = slice(offset + fade_length, offset + length)
+            if rest.start < rest.stop:
+                out[:, rest], self.zi = sosfilt(self.sos, block[:, rest], zi=self.zi)
+            offset += length
+
+        self.position += block_samples
+        return out
+
+    def _enter_step(self, step, channels):
+        sos = self.design_sos(self.frequencies[step % len(self.frequencies)])
+        if self.zi is None:
+            self.zi = np.zeros((sos.shape[0], channels, 2), dtype=sos.dtype)
+        elif self.crossfade_samples > 0:
+            self.previous_sos = self.sos
+            self.previous_zi = self.zi.copy()
+        self.sos = sos
+        self.step = step
@@ -0,0 +1,206 @@
+# live_ladder.py
+
+# The ladder for a real time audio callback. Everything is allocated when the processor is built,
+# process() only works in place on blocks of exactly block_size frames, in sounddevice's
+# (frames, channels) layout.
+#
+# scipy's lfilter/sosfilt always allocate their output, so the notch runs as a block state space
+# filter instead: for a block x and the filter state s (lfilter's zi)
+#   y  = T x + O s        T: lower triangular matrix of the impulse response, O: how s rings out
+#   s' = A^n s + K x      n: block size
+# which is four matmuls into preallocated arrays and gives the same output as lfilter.
+# Steps are rounded to whole blocks, at a few ms per block nobody hears the difference.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from filters.common.oscillator import BeepBank
+
+
+class BlockNotchBank:
+    # block matrices for a list of (b, a) filters, all with the same block size
+    def __init__(self, coefficients, block_size, dtype=np.float32):
+        order = max(max(len(b), len(a)) for b, a in coefficients) - 1
+        rungs = len(coefficients)
+        n = block_size
+
+        # transposed direct form II, the state is the same as lfilter's zi
+        A = np.zeros((rungs, order, order))
+        Bv = np.zeros((rungs, order))
+        D = np.zeros(rungs)
+        for rung, (b, a) in enumerate(coefficients):
+            b = np.pad(np.asarray(b, dtype=float), (0, order + 1 - len(b)))
+            a = np.pad(np.asarray(a, dtype=float), (0, order + 1 - len(a)))
+            b, a = b / a[0], a / a[0]
+            A[rung, :, 0] = -a[1:]
+            A[rung, np.arange(order - 1), np.arange(1, order)] = 1
+            Bv[rung] = b[1:] - a[1:] * b[0]
+            D[rung] = b[0]
+
+        self.impulse = np.empty((rungs, n))       # h[k] = D, C A^(k-1) Bv
+        self.observe = np.empty((rungs, n, order))  # O[k] = C A^k
+        self.gain = np.empty((rungs, order, n))   # K[:, j] = A^(n-1-j) Bv
+        self.impulse[:, 0] = D
+        row = np.zeros((rungs, order))
+        row[:, 0] = 1
+        column = Bv.copy()
+        power = np.broadcast_to(np.eye(order), (rungs, order, order)).copy()
+        for k in range(n):
+            self.observe[:, k] = row
+            self.gain[:, :, n - 1 - k] = column
+            if k + 1 < n:
+                self.impulse[:, k + 1] = column[:, 0]
+            row = np.einsum('ri,rij->rj', row, A)
+            column = np.einsum('rij,rj->ri', A, column)
+            power = A @ power
+        self.carry = power                        # A^n
+
+        self.impulse = self.impulse.astype(dtype)
+        self.observe = self.observe.astype(dtype)
+        self.gain = self.gain.astype(dtype)
+        self.carry = self.carry.astype(dtype)
+        self.order = order
+        self.block_size = n
+
+
+class LadderDesign:
+    # Everything of the live ladder that depends on the parameters. It's built outside the audio
+    # thread and never changed afterwards (the arrays are read-only): a parameter change builds a new
+    # one and publishes it to the LiveLadder.
+    __slots__ = ('block_size', 'dtype', 'num_rungs', 'step_blocks', 'beep_samples', 'continuous',
+                 'filter_mix', 'beep_mix', 'dry_mix', 'bank', 'beeps')
+
+    def __init__(self, frequencies, step_samples, beep_samples, design_filter, sample_rate, block_size,
+                 filter_mix=1.0, beep_mix=0.0, continuous=False, dtype=np.float32):
+        # design_filter(freq) -> (b, a); continuous carries the filter state over step changes,
+        # otherwise every step starts from silence like the stepwise mode
+        self.block_size = block_size
+        self.dtype = np.dtype(dtype)
+        self.num_rungs = len(frequencies)
+        self.step_blocks = max(1, round(step_samples / block_size))
+        self.beep_samples = beep_samples
+        self.continuous = continuous
+        self.filter_mix = filter_mix
+        self.beep_mix = beep_mix
+        self.dry_mix = 1 - filter_mix - beep_mix
+        self.bank = BlockNotchBank([design_filter(freq) for freq in frequencies], block_size, dtype)
+        self.beeps = BeepBank(frequencies, beep_samples, sample_rate).table.astype(dtype)
+        for array in (self.bank.impulse, self.bank.observe, self.bank.gain, self.bank.carry, self.beeps):
+            array.flags.writeable = False
+
+
+class LiveLadder:
+    # Parameter changes from other threads: publish() a new LadderDesign. The audio thread picks it up
+    # at the start of its next block (one reference read, no lock) and fades from the old design to
+    # the new one over that block: the mix gains are ramped and the old and new notch are crossfaded,
+    # with the new notch continuing from the old one's filter state.
+    def __init__(self, design, channels=2):
+        dtype = design.dtype
+        block_size = design.block_size
+        self.block_size = block_size
+        self.channels = channels
+        self.dtype = dtype
+        self.design = design
+        self.pending = design
+
+        order = design.bank.order
+        self.transfer = np.zeros((block_size, block_size), dtype=dtype)
+        # T[i, j] = h[i - j]: a sliding window over the zero padded impulse response, reversed
+        self.padded_impulse = np.zeros(2 * block_size - 1, dtype=dtype)
+        self.transfer_view = sliding_window_view(self.padded_impulse, block_size)[:, ::-1]
+        self.state = np.zeros((order, channels), dtype=dtype)
+        self.next_state = np.empty((order, channels), dtype=dtype)
+        self.state_input = np.empty((order, channels), dtype=dtype)
+        self.ringing = np.empty((block_size, channels), dtype=dtype)
+        self.filtered = np.empty((block_size, channels), dtype=dtype)
+        self.old_filtered = np.empty((block_size, channels), dtype=dtype)
+
+        # per sample gains, constant except in the block where a new design fades in. They are full
+        # (block_size, channels) arrays: numpy allocates a buffer for a (block_size, 1) column broadcast
+        # against the block, even with out=
+        ramp = (np.arange(1, block_size + 1) / block_size).astype(dtype)[:, None]
+        self.ramp = np.repeat(ramp, channels, axis=1)
+        self.fade_out = 1 - self.ramp
+        self.filter_gain = np.empty((block_size, channels), dtype=dtype)
+        self.dry_gain = np.empty((block_size, channels), dtype=dtype)
+        self.beep_gain = np.empty((block_size, channels), dtype=dtype)
+        self.beep_block = np.empty((block_size, 1), dtype=dtype)
+        self._hold_gains(design)
+        self.fading = False
+        self.block_index = 0
+        self.rung = -1
+
+    def publish(self, design):
+        # any thread; the design must have the same block size, dtype and filter order
+        if (design.block_size, design.dtype, design.bank.order) != (self.block_size, self.dtype, self.design.bank.order):
+            raise ValueError("The block size, precision and filter order can't change while playing.")
+        self.pending = design
+
+    def _hold_gains(self, design):
+        self.filter_gain[...] = design.filter_mix
+        self.dry_gain[...] = design.dry_mix
+        self.beep_gain[...] = design.beep_mix
+
+    def _ramp_gains(self, old, new):
+        for gain, before, after in ((self.filter_gain, old.filter_mix, new.filter_mix),
+                                    (self.dry_gain, old.dry_mix, new.dry_mix),
+                                    (self.beep_gain, old.beep_mix, new.beep_mix)):
+            np.multiply(self.ramp, after - before, out=gain)
+            gain += before
+
+    def _load_rung(self, design, rung):
+        self.padded_impulse[self.block_size - 1:] = design.bank.impulse[rung]
+        np.copyto(self.transfer, self.transfer_view)
+        self.rung = rung
+
+    def process(self, indata, outdata):
+        # indata, outdata: (block_size, channels) arrays of self.dtype, may be the same array
+        old, design = self.design, self.pending
+        if design is not old:
+            self._ramp_gains(old, design)
+            if self.rung >= 0:
+                # the old notch's last block, faded out
+                np.matmul(self.transfer, indata, out=self.old_filtered)
+                np.matmul(old.bank.observe[self.rung], self.state, out=self.ringing)
+                self.old_filtered += self.ringing
+                self.old_filtered *= self.fade_out
+                self.fading = True
+            self.design = design
+            self.rung = -1
+        elif self.fading:
+            self._hold_gains(design)
+            self.fading = False
+
+        step, block_in_step = divmod(self.block_index, design.step_blocks)
+        rung = step % design.num_rungs
+        if rung != self.rung:
+            self._load_rung(design, rung)
+        if block_in_step == 0 and not design.continuous:
+            self.state[...] = 0
+
+        bank = design.bank
+        filtered = self.filtered
+        np.matmul(self.transfer, indata, out=filtered)
+        np.matmul(bank.observe[rung], self.state, out=self.ringing)
+        filtered += self.ringing
+        np.matmul(bank.carry[rung], self.state, out=self.next_state)
+        np.matmul(bank.gain[rung], indata, out=self.state_input)
+        np.add(self.next_state, self.state_input, out=self.state)
+        if self.fading:
+            filtered *= self.ramp
+            filtered += self.old_filtered
+
+        filtered *= self.filter_gain
+        np.multiply(indata, self.dry_gain, out=outdata)
+        outdata += filtered
+
+        beep_pos = block_in_step * self.block_size
+        if beep_pos < design.beep_samples:
+            length = min(self.block_size, design.beep_samples - beep_pos)
+            channel = min(step % 2, self.channels - 1)
+            beep = self.beep_block[:length, 0]
+            np.multiply(design.beeps[rung, beep_pos:beep_pos + length], self.beep_gain[:length, 0], out=beep)
+            outdata[:length, channel] += beep
+
+        self.block_index += 1
+        return outdata
@@ -0,0 +1,97 @@
+# notch_cache.py
+
+# The ladder only cycles through a handful of frequencies, so there is no reason to design the
+# same filter again on every step. All filters share one bounded LRU cache here.
+# The hits/misses counters are there for profiling, see cache_stats().
+
+import threading
+from collections import OrderedDict
+
+from scipy.signal import butter, iirnotch, tf2sos
+
+
+class CoefficientCache:
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, design):
+        with self._lock:
+            coefficients = self._entries.get(key)
+            if coefficients is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return coefficients
+            self.misses += 1
+
+        # the same arrays are handed to every caller, don't modify them in place
+        # (not marked read-only, sosfilt refuses read-only coefficient buffers)
+        coefficients = design()
+
+        with self._lock:
+            self._entries[key] = coefficients
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return coefficients
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+coefficient_cache = CoefficientCache()
+
+
+def _as_output(b, a, output):
+    if output == 'sos':
+        return (tf2sos(b, a),)
+    if output == 'ba':
+        return b, a
+    raise ValueError(f"Unsupported filter output: {output}")
+
+
+def iirnotch_coefficients(freq, q, fs, output='ba'):
+    # same design as the apply_notch_filter functions: iirnotch on the nyquist normalized frequency
+    def design():
+        b, a = iirnotch(freq / (0.5 * fs), q)
+        return _as_output(b, a, output)
+
+    coefficients = coefficient_cache.get(('iirnotch', float(freq), float(q), float(fs), output), design)
+    return coefficients[0] if output == 'sos' else coefficients
+
+
+def bandstop_coefficients(center_freq, q, fs, order=2, output='ba'):
+    # butterworth band stop of center_freq / q wide, as bandfilter-5's create_notch_filter
+    def design():
+        bandwidth = center_freq / q
+        nyq = 0.5 * fs
+        low = max(0.0, min((center_freq - bandwidth / 2) / nyq, 1.0))
+        high = max(0.0, min((center_freq + bandwidth / 2) / nyq, 1.0))
+        if output == 'sos':
+            return (butter(order, [low, high], btype='bandstop', analog=False, output='sos'),)
+        return butter(order, [low, high], btype='bandstop', analog=False, output='ba')
+
+    key = ('bandstop', float(center_freq), float(q), float(fs), order, output)
+    coefficients = coefficient_cache.get(key, design)
+    return coefficients[0] if output == 'sos' else coefficients
+
+
+def cache_stats():
+    return coefficient_cache.stats()
@@ -0,0 +1,131 @@
+# oscillator.py
+
+# Tone synthesis without np.linspace / np.sin over fresh arrays for every beep.
+# A Phasor keeps a table of e^(j*w*k) for one block and its phase between calls: a block of output
+# is that table rotated to the current phase, written into buffers that are allocated once.
+# So tones are phase continuous across blocks, and after the first block nothing is allocated.
+#
+# All render() methods write into a caller supplied float array (add=True mixes into it instead).
+
+import numpy as np
+
+DEFAULT_BLOCK = 4096
+
+
+class Phasor:
+    def __init__(self, freq, sample_rate, phase=0.0, block_size=DEFAULT_BLOCK):
+        self.freq = freq
+        self.sample_rate = sample_rate
+        self.omega = 2 * np.pi * freq / sample_rate
+        self.start_phase = phase
+        self.phase = phase
+        self.block_size = block_size
+        self.table = np.exp(1j * self.omega * np.arange(block_size))
+        self.scratch = np.empty(block_size, dtype=complex)
+
+    def seek(self, sample):
+        # jump to the phase the tone has at this sample position (counted from phase at sample 0)
+        self.phase = (self.start_phase + self.omega * sample) % (2 * np.pi)
+
+    def blocks(self, samples):
+        # yields (offset, e^(j*phase) for the next n samples) as views into the scratch buffer
+        offset = 0
+        while offset < samples:
+            n = min(self.block_size, samples - offset)
+            np.multiply(self.table[:n], np.exp(1j * self.phase), out=self.scratch[:n])
+            self.phase = (self.phase + self.omega * n) % (2 * np.pi)
+            yield offset, self.scratch[:n]
+            offset += n
+
+
+class SineOscillator:
+    def __init__(self, freq, sample_rate, phase=0.0, block_size=DEFAULT_BLOCK):
+        self.phasor = Phasor(freq, sample_rate, phase, block_size)
+
+    def seek(self, sample):
+        self.phasor.seek(sample)
+
+    def render(self, out, gain=1.0, add=False):
+        for offset, rotation in self.phasor.blocks(len(out)):
+            target = out[offset:offset + len(rotation)]
+            if add:
+                target += gain * rotation.imag
+            else:
+                np.multiply(rotation.imag, gain, out=target)
+        return out
+
+
+class AmOscillator:
+    # carrier * 0.5 * (1 + sin(modulator)), as bandfilter-5's generate_am_tone was
+    def __init__(self, freq, mod_freq, sample_rate, block_size=DEFAULT_BLOCK):
+        self.carrier = Phasor(freq, sample_rate, block_size=block_size)
+        self.modulator = Phasor(mod_freq, sample_rate, block_size=block_size)
+        self.work = np.empty(block_size)
+
+    def seek(self, sample):
+        self.carrier.seek(sample)
+        self.modulator.seek(sample)
+
+    def render(self, out, gain=1.0, add=False):
+        for (offset, carrier), (_, modulator) in zip(self.carrier.blocks(len(out)), self.modulator.blocks(len(out))):
+            work = self.work[:len(carrier)]
+            np.add(modulator.imag, 1.0, out=work)
+            work *= 0.5 * gain
+            work *= carrier.imag
+            target = out[offset:offset + len(carrier)]
+            if add:
+                target += work
+            else:
+                target[:] = work
+        return out
+
+
+class FmOscillator:
+    # sin(carrier + mod_index * sin(modulator)), as bandfilter-5's generate_fm_tone was, via
+    # sin(a + b) = sin(a) cos(b) + cos(a) sin(b) so the carrier can stay a phasor
+    def __init__(self, freq, mod_freq, mod_index, sample_rate, block_size=DEFAULT_BLOCK):
+        self.carrier = Phasor(freq, sample_rate, block_size=block_size)
+        self.modulator = Phasor(mod_freq, sample_rate, block_size=block_size)
+        self.mod_index = mod_index
+        self.deviation = np.empty(block_size)
+        self.work = np.empty(block_size)
+
+    def seek(self, sample):
+        self.carrier.seek(sample)
+        self.modulator.seek(sample)
+
+    def render(self, out, gain=1.0, add=False):
+        for (offset, carrier), (_, modulator) in zip(self.carrier.blocks(len(out)), self.modulator.blocks(len(out))):
+            n = len(carrier)
+            deviation, work = self.deviation[:n], self.work[:n]
+            np.multiply(modulator.imag, self.mod_index, out=deviation)
+            np.cos(deviation, out=work)
+            work *= carrier.imag
+            np.sin(deviation, out=deviation)
+            deviation *= carrier.real
+            work += deviation
+            target = out[offset:offset + n]
+            if add:
+                target += gain * work
+            else:
+                np.multiply(work, gain, out=target)
+        return out
+
+
+class BeepBank:
+    # One beep per frequency, rendered once. Beeps always start at phase 0 like the ladder's did,
+    # write() copies (part of) a beep into place.
+    def __init__(self, frequencies, beep_samples, sample_rate, gain=1.0):
+        self.table = np.zeros((len(frequencies), beep_samples))
+        for index, freq in enumerate(frequencies):
+            SineOscillator(freq, sample_rate, block_size=max(1, min(beep_samples, DEFAULT_BLOCK))).render(
+                self.table[index], gain)
+
+    def write(self, index, out, start=0, add=False):
+        # beep samples start..start+len(out)
+        beep = self.table[index, start:start + len(out)]
+        if add:
+            out[:len(beep)] += beep
+        else:
+            out[:len(beep)] = beep
+        return out
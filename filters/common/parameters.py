@@ -0,0 +1,103 @@
+# parameters.py
+
+# Typed, validated filter parameters. A filter lists its parameters as Parameter specs on a
+# ParameterSet subclass; compiling the JSON values into one of those checks every value once and
+# gives an object with plain attributes, so the render code never does dict lookups or has to cope
+# with a bandwidth of 0 halfway through a track.
+#
+# A ParameterSet is read-only, a changed value means a new set (replace()). Values that depend on the
+# sample rate (sample counts and such) come from derived(sample_rate), computed once per rate.
+
+
+class Parameter:
+    __slots__ = ('name', 'kind', 'minimum', 'maximum', 'above', 'choices')
+
+    def __init__(self, name, kind=float, minimum=None, maximum=None, above=None, choices=None):
+        # minimum/maximum are inclusive, above is an exclusive lower bound
+        self.name = name
+        self.kind = kind
+        self.minimum = minimum
+        self.maximum = maximum
+        self.above = above
+        self.choices = choices
+
+    def validate(self, value):
+        if self.choices is not None:
+            if value not in self.choices:
+                raise ValueError(f"{self.name} must be one of {', '.join(map(str, self.choices))}, not {value!r}")
+            return value
+        # bools are ints to Python, but never a valid number here
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{self.name} must be a number, not {value!r}")
+        if self.kind is int:
+            if value != int(value):
+                raise ValueError(f"{self.name} must be a whole number, not {value!r}")
+            value = int(value)
+        else:
+            value = float(value)
+        if value != value:
+            raise ValueError(f"{self.name} can't be NaN")
+        if self.above is not None and not value > self.above:
+            raise ValueError(f"{self.name} must be above {self.above}, not {value}")
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(f"{self.name} must be at least {self.minimum}, not {value}")
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError(f"{self.name} must be at most {self.maximum}, not {value}")
+        return value
+
+
+class ParameterSet:
+    # subclasses set specs and __slots__ (the spec names), and may override check() and at_rate()
+    __slots__ = ('_derived',)
+    specs = ()
+
+    def __init__(self, values):
+        missing = [spec.name for spec in self.specs if spec.name not in values]
+        if missing:
+            raise ValueError(f"Missing parameters: {', '.join(missing)}")
+        for spec in self.specs:
+            object.__setattr__(self, spec.name, spec.validate(values[spec.name]))
+        object.__setattr__(self, '_derived', {})
+        self.check()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Parameters are read-only, use replace() for changed values.")
+
+    @classmethod
+    def names(cls):
+        return [spec.name for spec in cls.specs]
+
+    def as_dict(self):
+        return {spec.name: getattr(self, spec.name) for spec in self.specs}
+
+    def replace(self, **changes):
+        unknown = [name for name in changes if name not in self.names()]
+        if unknown:
+            raise ValueError(f"Invalid parameter name: {', '.join(unknown)}")
+        return type(self)(dict(self.as_dict(), **changes))
+
+    def check(self):
+        # rules between parameters, raise ValueError
+        pass
+
+    def at_rate(self, sample_rate):
+        # values derived for one sample rate
+        return {}
+
+    def derived(self, sample_rate):
+        derived = self._derived.get(sample_rate)
+        if derived is None:
+            if sample_rate <= 0:
+                raise ValueError(f"Invalid sample rate: {sample_rate}")
+            derived = self._derived[sample_rate] = self.at_rate(sample_rate)
+        return derived
+
+
+def compile_parameters(parameter_class, default_values, custom_values=None):
+    # JSON values (custom over default) -> parameter_class instance, ValueError if anything is off
+    values = dict(default_values)
+    values.update(custom_values or {})
+    unknown = [name for name in values if name not in parameter_class.names()]
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(unknown)}")
+    return parameter_class(values)
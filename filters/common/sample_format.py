@@ -0,0 +1,50 @@
+# sample_format.py
+
+# Filters work on float samples in -1..1, float32 unless float64 is asked for.
+# Integer PCM only exists at the edges: converted to float on the way in and quantized
+# (optionally with TPDF dither) on the way out, see audio_io.py.
+
+import numpy as np
+
+INTERNAL_DTYPES = {
+    "float32": np.float32,
+    "float64": np.float64,
+}
+
+PCM_BITS = {
+    "PCM_16": 16,
+    "PCM_24": 24,
+}
+
+
+def internal_dtype(precision):
+    try:
+        return np.dtype(INTERNAL_DTYPES[precision])
+    except KeyError:
+        raise ValueError(f"Unsupported precision: {precision}")
+
+
+def to_internal(data, dtype=np.float32):
+    # integer samples are scaled to -1..1, float samples are only cast (no copy if already right)
+    data = np.asarray(data)
+    if np.issubdtype(data.dtype, np.integer):
+        scale = float(2 ** (8 * data.dtype.itemsize - 1))
+        return np.multiply(data, 1.0 / scale, dtype=dtype)
+    return data.astype(dtype, copy=False)
+
+
+def to_pcm(data, bits=16, dither=True, rng=None):
+    # 16 bit comes back as int16, 24 bit as left aligned int32 (what soundfile expects for PCM_24)
+    if bits not in (16, 24):
+        raise ValueError(f"Unsupported bit depth: {bits}")
+    scale = float(2 ** (bits - 1))
+    scaled = np.asarray(data, dtype=np.float64) * scale
+    if dither:
+        # triangular dither of +-1 LSB, decorrelates the rounding error from the signal
+        rng = rng if rng is not None else np.random.default_rng()
+        scaled += rng.random(scaled.shape) - rng.random(scaled.shape)
+    np.rint(scaled, out=scaled)
+    np.clip(scaled, -scale, scale - 1, out=scaled)
+    if bits == 16:
+        return scaled.astype(np.int16)
+    return scaled.astype(np.int32) << 8
@@ -0,0 +1,50 @@
+# segment_mixer.py
+
+# Mixes sources segment by segment: segment i of the track uses the mix segments[i % len(segments)].
+# Every segment only reads and writes its own samples, once, so mixing time grows linearly with the
+# track length (the old loop summed whole tracks for every segment and then kept 4 seconds of it).
+#
+# A source is either a (channels, samples) array or anything with render(start, end), like the
+# stages of treatment_graph.py.
+
+import numpy as np
+
+
+def read_source(source, start, end):
+    if hasattr(source, 'render'):
+        return source.render(start, end)
+    return source[:, start:end]
+
+
+class SegmentMixer:
+    # segments: [(segment name, {source name: volume}) or (segment name, [(source, volume), ...]), ...]
+    def __init__(self, segments, segment_samples):
+        if not segments:
+            raise ValueError("At least one segment is needed.")
+        if segment_samples <= 0:
+            raise ValueError(f"Invalid segment length: {segment_samples}")
+        self.segments = [(name, list(mix.items()) if isinstance(mix, dict) else list(mix)) for name, mix in segments]
+        self.segment_samples = segment_samples
+
+    def layout(self, total_samples):
+        # yields (segment name, start, end, mix) for every segment of the track
+        for index, start in enumerate(range(0, total_samples, self.segment_samples)):
+            name, mix = self.segments[index % len(self.segments)]
+            yield name, start, min(start + self.segment_samples, total_samples), mix
+
+    def mix_segment(self, mix, start, end, out, sources=None):
+        # sources maps the names in mix to sources, without it the mix holds the sources themselves
+        out[...] = 0
+        for key, volume in mix:
+            if volume == 0:
+                continue
+            source = sources[key] if sources is not None else key
+            out += volume * read_source(source, start, end)
+        return out
+
+    def mix(self, sources, total_samples, out=None, channels=2):
+        if out is None:
+            out = np.empty((channels, total_samples))
+        for _, start, end, mix in self.layout(total_samples):
+            self.mix_segment(mix, start, end, out[:, start:end], sources)
+        return out
@@ -0,0 +1,72 @@
+# stft_engine.py
+
+# Ladder notching in the frequency domain. The track is cut in 50% overlapping frames, every frame
+# gets the notch of the rung it falls in as a gain mask over its spectrum, and overlap-add puts
+# it back together. A chunk costs one batched forward and one inverse FFT, no matter how many rungs
+# the ladder has or how short the steps are.
+#
+# Frames sit on a fixed grid over the whole track, so a chunk renders exactly the same samples as
+# rendering everything at once. The mask is |H|^2 of the iirnotch, the zero-phase response that
+# filtfilt applies in stepwise mode.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft
+from scipy.signal import freqz
+
+
+class SpectralLadderNotch:
+    def __init__(self, frequencies, step_samples, design_filter, sample_rate, frame_size=2048):
+        # design_filter(freq) -> (b, a)
+        if frame_size < 2 or frame_size % 2:
+            raise ValueError(f"FFT size must be even: {frame_size}")
+        self.frame_size = frame_size
+        self.hop = frame_size // 2
+        self.step_samples = step_samples
+        self.num_rungs = len(frequencies)
+        # sqrt of a periodic Hann window on both sides, at 50% overlap the products add up to 1
+        self.window = np.sqrt(0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame_size) / frame_size))
+
+        bin_freqs = np.fft.rfftfreq(frame_size, 1 / sample_rate)
+        self.masks = np.empty((len(frequencies), len(bin_freqs)))
+        for rung, freq in enumerate(frequencies):
+            b, a = design_filter(freq)
+            _, response = freqz(np.asarray(b, dtype=float), np.asarray(a, dtype=float), worN=bin_freqs, fs=sample_rate)
+            self.masks[rung] = np.abs(response) ** 2
+
+    def frame_rungs(self, first_frame, num_frames):
+        # each frame takes the rung of the step its center falls in, the ladder climbs once
+        # so frames past the last step keep the last rung
+        centers = (first_frame + np.arange(num_frames)) * self.hop + self.hop
+        steps = np.maximum(centers, 0) // self.step_samples
+        return np.minimum(steps, self.num_rungs - 1)
+
+    def process(self, data, start, end, out):
+        # filters data[:, start:end] into out (same length), data is the whole track (may be a memmap)
+        channels, total_samples = data.shape
+        hop, frame_size = self.hop, self.frame_size
+        first_frame = start // hop - 1
+        last_frame = (end - 1) // hop
+        num_frames = last_frame - first_frame + 1
+
+        # input covering all frames, zeros outside the track
+        segment_start = first_frame * hop
+        segment_end = segment_start + (num_frames + 1) * hop
+        segment = np.zeros((channels, segment_end - segment_start), dtype=out.dtype)
+        copy_start, copy_end = max(segment_start, 0), min(segment_end, total_samples)
+        segment[:, copy_start - segment_start:copy_end - segment_start] = data[:, copy_start:copy_end]
+
+        # scipy.fft keeps float32 audio in single precision
+        window = self.window.astype(out.dtype, copy=False)
+        frames = sliding_window_view(segment, frame_size, axis=1)[:, ::hop] * window
+        spectra = fft.rfft(frames, axis=-1, overwrite_x=True)
+        spectra *= self.masks[self.frame_rungs(first_frame, num_frames)].astype(out.dtype, copy=False)
+        frames = fft.irfft(spectra, n=frame_size, axis=-1, overwrite_x=True)
+        frames *= window
+
+        # overlap-add: every hop is the second half of one frame plus the first half of the next
+        summed = frames[:, 1:, :hop] + frames[:, :-1, hop:]
+        summed = summed.reshape(channels, -1)
+        offset = start - (segment_start + hop)
+        out[:, :] = summed[:, offset:offset + (end - start)]
+        return out
@@ -0,0 +1,151 @@
+# treatment_graph.py
+
+# A treatment is a set of stages (the music itself, notched music, ladder, tones, noise) and a list
+# of segments saying which stages are heard at what volume. The graph renders it segment by segment:
+# only the stages that are part of the current segment are evaluated, and only for that segment,
+# so none of the stages ever exists as a full length array.
+#
+# Stages read from a Signal with read(start, end), which zero pads outside the track, so a stage can
+# look a bit past its block edges where it needs context (zero-phase filters, ladder steps).
+
+import numpy as np
+
+from filters.common.ladder import filter_steps, filtfilt_safe, render_beeps
+from filters.common.segment_mixer import SegmentMixer
+
+
+class Signal:
+    # (channels, samples) array, optionally scaled per channel on read
+    def __init__(self, data, length=None, scale=None):
+        self.data = data
+        self.channels = data.shape[0]
+        self.length = data.shape[1] if length is None else length
+        self.scale = None if scale is None else np.asarray(scale, dtype=data.dtype)[:, None]
+
+    def read(self, start, end):
+        block = np.zeros((self.channels, end - start), dtype=self.data.dtype)
+        copy_start, copy_end = max(start, 0), min(end, self.length, self.data.shape[1])
+        if copy_start < copy_end:
+            block[:, copy_start - start:copy_end - start] = self.data[:, copy_start:copy_end]
+            if self.scale is not None:
+                block[:, copy_start - start:copy_end - start] *= self.scale
+        return block
+
+
+class SignalStage:
+    def __init__(self, signal):
+        self.signal = signal
+
+    def render(self, start, end):
+        return self.signal.read(start, end)
+
+
+class ZeroPhaseFilterStage:
+    # filtfilt over the block plus context samples on both sides, with enough context (many times
+    # the filter's ring time) this matches filtfilt over the whole track
+    def __init__(self, signal, b, a, context_samples):
+        self.signal = signal
+        self.b = b
+        self.a = a
+        self.context_samples = context_samples
+
+    def render(self, start, end):
+        context = self.context_samples
+        block = self.signal.read(start - context, end + context)
+        return filtfilt_safe(self.b, self.a, block)[:, context:context + end - start]
+
+
+class LadderStage:
+    # the bandfilter-5 ladder: beep at the start of every step (mixed with beep_mix), notch after it
+    def __init__(self, signal, schedule, design_filter, beep_samples, sample_rate, beep_mix=0.3):
+        self.signal = signal
+        self.schedule = schedule
+        self.design_filter = design_filter
+        self.beep_samples = beep_samples
+        self.sample_rate = sample_rate
+        self.beep_mix = beep_mix
+        self.step_samples = int(schedule.ends[0] - schedule.starts[0])
+
+    def render(self, start, end):
+        first = start // self.step_samples
+        last = min(-(-end // self.step_samples), len(self.schedule))
+        schedule = self.schedule.slice(first, last)
+        span_start = int(self.schedule.starts[first])
+        chunk = self.signal.read(span_start, int(self.schedule.ends[last - 1]))
+
+        ladder = np.zeros_like(chunk)
+        filter_steps(chunk, schedule, self.design_filter, ladder, skip=self.beep_samples)
+        beeps = np.zeros_like(chunk)
+        render_beeps(schedule, self.beep_samples, self.sample_rate, beeps)
+        in_beep = (np.arange(chunk.shape[1]) % self.step_samples) < self.beep_samples
+        ladder[:, in_beep] = (1 - self.beep_mix) * chunk[:, in_beep] + self.beep_mix * beeps[:, in_beep]
+        return ladder[:, start - span_start:end - span_start]
+
+
+class ToneStage:
+    # an oscillator from oscillator.py, the same tone on every channel. Blocks usually follow each
+    # other, the seek only matters when segments without this tone were skipped.
+    def __init__(self, oscillator, channels=2):
+        self.oscillator = oscillator
+        self.channels = channels
+
+    def render(self, start, end):
+        self.oscillator.seek(start)
+        tone = self.oscillator.render(np.empty(end - start))
+        return np.broadcast_to(tone, (self.channels, end - start))
+
+
+class NoiseStage:
+    # Band filtered white noise. The noise is drawn in fixed chunks seeded by chunk number, so any
+    # block can be rendered on its own and still belongs to one and the same noise track.
+    def __init__(self, b, a, context_samples, seed=0, channels=2, chunk_samples=65536):
+        self.b = b
+        self.a = a
+        self.context_samples = context_samples
+        self.seed = seed
+        self.channels = channels
+        self.chunk_samples = chunk_samples
+
+    def _noise(self, start, end):
+        first, last = start // self.chunk_samples, -(-end // self.chunk_samples)
+        # chunks before the start of the track are only filter context, they get seeds of their own too
+        noise = np.concatenate([np.random.default_rng([self.seed, chunk % 2 ** 32]).standard_normal(self.chunk_samples)
+                                for chunk in range(first, last)])
+        offset = start - first * self.chunk_samples
+        return noise[offset:offset + end - start]
+
+    def render(self, start, end):
+        context = self.context_samples
+        filtered = filtfilt_safe(self.b, self.a, self._noise(start - context, end + context))
+        return np.broadcast_to(filtered[context:context + end - start], (self.channels, end - start))
+
+
+class TreatmentGraph:
+    # stages: {name: stage}, segments: [(segment name, {stage name: volume}), ...] repeated over the track
+    def __init__(self, stages, segments, segment_samples, channels=2):
+        self.stages = stages
+        self.channels = channels
+        self.mixer = SegmentMixer(self.compile(segments), segment_samples)
+
+    def compile(self, segments):
+        # resolves the stage names and drops silent stages, the mixer then works on stage objects
+        plan = []
+        for name, mix in segments:
+            unknown = [key for key in mix if key not in self.stages]
+            if unknown:
+                raise ValueError(f"Segment '{name}' uses unknown stages: {', '.join(unknown)}")
+            plan.append((name, [(self.stages[key], volume) for key, volume in mix.items() if volume != 0]))
+        return plan
+
+    def blocks(self, total_samples):
+        # yields (segment name, start, end, mixed block)
+        for name, start, end, mix in self.mixer.layout(total_samples):
+            block = np.empty((self.channels, end - start))
+            yield name, start, end, self.mixer.mix_segment(mix, start, end, block)
+
+    def render(self, total_samples, out=None):
+        if out is None:
+            out = np.empty((self.channels, total_samples))
+        for _, start, end, block in self.blocks(total_samples):
+            out[:, start:end] = block
+        return out
@@ -0,0 +1,371 @@
+# job_service.py
+
+# Render jobs from several clients on one machine. A small asyncio server takes jobs for any filter
+# FilterManager knows. It runs a few of them at a time on worker threads and streams their progress
+# while the filter works through the track chunk by chunk. Jobs can be cancelled, queued or running.
+#
+#   python job_service.py serve --workers 2 --max-queued 16
+#   python job_service.py submit ladder2 "C:\music\song.mp3" rendered\song.mp3 --params my_values.json
+#   python job_service.py list
+#   python job_service.py cancel 3
+#
+# The protocol is one JSON object per line, over TCP on localhost or over a Unix socket (--socket):
+#   {"op": "submit", "filter": ..., "input": ..., "output": ..., "params": {...}, "watch": true}
+#   {"op": "watch", "job": id}  {"op": "cancel", "job": id}  {"op": "status", "job": id}
+#   {"op": "list"}  {"op": "filters"}
+# Every answer is one line with the job's status (or {"error": ...}). Watch sends a line for every
+# change until the job is done, failed or cancelled.
+#
+# Memory stays bounded however many jobs come in. Only `workers` tracks are decoded at a time (memory
+# mapped from the decode cache), at most max_queued more jobs wait, and past that a submit gets an
+# error back and has to try again later. A client that reads slowly gets the latest state when it reads
+# again; no updates pile up for it.
+
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_console import load_parameters
+from disk_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DecodeCache, RenderCache
+from main_console import FilterManager, process_audio
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, filter_name, input_file, output_file, parameters):
+        self.id = job_id
+        self.filter_name = filter_name
+        self.input_file = input_file
+        self.output_file = output_file
+        self.parameters = parameters
+        self.state = QUEUED
+        self.progress = 0.0
+        self.duration = None
+        self.error = None
+        self.cancel_requested = False  # read by the worker thread after every chunk
+        self.changed = asyncio.Event()
+
+    def status(self):
+        status = {"job": self.id, "state": self.state, "progress": round(self.progress, 4),
+                  "filter": self.filter_name, "input": self.input_file, "output": self.output_file}
+        if self.duration is not None:
+            status["duration"] = self.duration
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+    def update(self, **changes):
+        # event loop only. Wakes every watcher, each one reads the state whenever it gets to it.
+        for name, value in changes.items():
+            setattr(self, name, value)
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class JobService:
+    def __init__(self, workers=2, max_queued=16, filter_dir='filters', cache_dir=DEFAULT_CACHE_DIR,
+                 cache_bytes=DEFAULT_MAX_BYTES, scratch_dir=None, keep_finished=100):
+        # cache_dir None renders without the render and decode caches
+        self.workers = workers
+        self.max_queued = max_queued
+        self.manager = FilterManager(filter_dir)
+        self.scratch_dir = scratch_dir
+        self.keep_finished = keep_finished
+        self.render_cache = self.decode_cache = None
+        if cache_dir is not None:
+            self.render_cache = RenderCache(os.path.join(cache_dir, 'renders'), cache_bytes)
+            self.decode_cache = DecodeCache(os.path.join(cache_dir, 'decoded'), cache_bytes)
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.loop = None
+        self.queue = None
+        self.executor = None
+        self.worker_tasks = []
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.max_queued)
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='render')
+        self.worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if socket_path is not None:
+            return await asyncio.start_unix_server(self._client, socket_path)
+        return await asyncio.start_server(self._client, host, port)
+
+    def stop(self):
+        # running jobs stop at their next chunk
+        for job in self.jobs.values():
+            if job.state in (QUEUED, RUNNING):
+                self.cancel(job)
+        for task in self.worker_tasks:
+            task.cancel()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def submit(self, filter_name, input_file, output_file, parameters=None):
+        filter_name = filter_name.lower()
+        parameters = parameters or {}
+        if filter_name not in self.manager.manifest:
+            raise ValueError(f"Filter '{filter_name}' not found.")
+        if not os.path.isfile(input_file):
+            raise ValueError(f"Input file not found: {input_file}")
+        # bad parameter values are an error for the client now, not when the job gets its turn
+        await self.loop.run_in_executor(None, self._configured_filter, filter_name, parameters)
+        if self.queue.full():
+            raise ServiceBusy(f"Queue full ({self.max_queued} jobs waiting), try again later.")
+        job = Job(next(self.ids), filter_name, input_file, output_file, parameters)
+        self.queue.put_nowait(job)
+        self.jobs[job.id] = job
+        self._forget_finished()
+        return job
+
+    def cancel(self, job):
+        if job.state == QUEUED:
+            job.update(state=CANCELLED)
+            self._drop_cancelled()
+        elif job.state == RUNNING:
+            job.cancel_requested = True
+
+    def _drop_cancelled(self):
+        # takes cancelled jobs out of the queue, so they don't hold places a new submit could have.
+        # No awaits in here, nothing else touches the queue meanwhile; the order of the rest stays.
+        waiting = []
+        while not self.queue.empty():
+            job = self.queue.get_nowait()
+            self.queue.task_done()
+            if job.state != CANCELLED:
+                waiting.append(job)
+        for job in waiting:
+            self.queue.put_nowait(job)
+
+    def job(self, job_id):
+        try:
+            return self.jobs[int(job_id)]
+        except (KeyError, ValueError, TypeError):
+            raise ValueError(f"Unknown job: {job_id}") from None
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
+
+    def _configured_filter(self, filter_name, parameters):
+        # a fresh filter object for every job, filters keep their input and parameters on themselves
+        filter_obj = self.manager.load_filter(filter_name)
+        filter_obj.adjust_parameters(parameters)
+        return filter_obj
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.state == CANCELLED:
+                    continue
+                job.update(state=RUNNING)
+                try:
+                    duration = await self.loop.run_in_executor(self.executor, self._render, job)
+                except JobCancelled:
+                    job.update(state=CANCELLED)
+                except Exception as e:
+                    job.update(state=FAILED, error=str(e))
+                else:
+                    job.update(state=DONE, progress=1.0, duration=duration)
+            finally:
+                self.queue.task_done()
+
+    def _render(self, job):
+        # worker thread. Cancelling takes effect at the next chunk, decoding and writing the file run to the end.
+        def progress(done, total):
+            if job.cancel_requested:
+                raise JobCancelled()
+            self.loop.call_soon_threadsafe(functools.partial(job.update, progress=done / total))
+
+        if job.cancel_requested:
+            raise JobCancelled()
+        filter_obj = self._configured_filter(job.filter_name, job.parameters)
+        return process_audio(filter_obj, job.input_file, job.output_file, self.scratch_dir, self.render_cache,
+                             self.decode_cache, progress)
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    await self._handle(json.loads(line), writer)
+                except KeyError as e:
+                    await send(writer, {"error": f"Missing field: {e.args[0]}"})
+                except (ValueError, ServiceBusy) as e:
+                    await send(writer, {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, request, writer):
+        # anything that isn't what the protocol says is an error for the client, not for the connection
+        if not isinstance(request, dict):
+            raise ValueError("A request must be a JSON object.")
+        op = request.get("op")
+        if op == "submit":
+            job = await self.submit(field(request, "filter", str), field(request, "input", str),
+                                    field(request, "output", str), field(request, "params", dict, required=False))
+            if request.get("watch"):
+                await self._watch(job, writer)
+            else:
+                await send(writer, job.status())
+        elif op == "watch":
+            await self._watch(self.job(request["job"]), writer)
+        elif op == "cancel":
+            job = self.job(request["job"])
+            self.cancel(job)
+            await send(writer, job.status())
+        elif op == "status":
+            await send(writer, self.job(request["job"]).status())
+        elif op == "list":
+            await send(writer, {"jobs": [job.status() for job in self.jobs.values()]})
+        elif op == "filters":
+            await send(writer, {"filters": self.manager.filter_names()})
+        else:
+            raise ValueError(f"Unknown op: {op}")
+
+    async def _watch(self, job, writer):
+        while True:
+            # taken before sending, so a change while the client reads isn't missed
+            changed = job.changed
+            await send(writer, job.status())
+            if job.state in FINISHED:
+                return
+            await changed.wait()
+
+
+def field(request, name, kind, required=True):
+    # request[name] if it has the right JSON type, None for a missing optional field
+    if name not in request or (request[name] is None and not required):
+        if required:
+            raise KeyError(name)
+        return None
+    value = request[name]
+    if not isinstance(value, kind):
+        names = {str: "a string", dict: "an object"}
+        raise ValueError(f"Field '{name}' must be {names.get(kind, kind.__name__)}, not {json.dumps(value)}")
+    return value
+
+
+async def send(writer, message):
+    # drain() waits while the client doesn't read, that only holds up this client
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+
+async def serve(args):
+    cache_dir = None if args.no_cache else args.cache_dir
+    service = JobService(args.workers, args.max_queued, args.filter_dir, cache_dir,
+                         int(args.cache_size * 2 ** 30), args.scratch_dir)
+    server = await service.start(args.host, args.port, args.socket)
+    print(f"Serving on {args.socket or f'{args.host}:{args.port}'} with {args.workers} workers.")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.stop()
+
+
+async def request(args, message):
+    # sends one request and prints the answers, a progress line for watched jobs
+    if args.socket is not None:
+        reader, writer = await asyncio.open_unix_connection(args.socket)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        writer.write(json.dumps(message).encode() + b'\n')
+        await writer.drain()
+        watching = message.get("watch") or message["op"] == "watch"
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            answer = json.loads(line)
+            if "error" in answer and "job" not in answer:
+                print(f"Error: {answer['error']}")
+                return
+            if not watching:
+                print(json.dumps(answer, indent=4))
+                return
+            print(f"\rJob {answer['job']}: {answer['state']} {answer['progress']:6.1%}", end="", flush=True)
+            if answer["state"] in FINISHED:
+                print(f"\n{answer['error']}" if answer["state"] == FAILED else "")
+                return
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local render job service.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="Unix socket path instead of TCP")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the service")
+    serve_parser.add_argument("--workers", type=int, default=2, help="jobs rendered at the same time (default 2)")
+    serve_parser.add_argument("--max-queued", type=int, default=16, help="jobs waiting before submits are refused")
+    serve_parser.add_argument("--filter-dir", default="filters")
+    serve_parser.add_argument("--scratch-dir", help="keep the audio in memory mapped files here instead of RAM")
+    serve_parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    serve_parser.add_argument("--cache-size", type=float, default=DEFAULT_MAX_BYTES / 2 ** 30,
+                              help="size limit of each cache in GB")
+    serve_parser.add_argument("--no-cache", action="store_true")
+
+    submit_parser = commands.add_parser("submit", help="render a track and follow its progress")
+    submit_parser.add_argument("filter")
+    submit_parser.add_argument("input")
+    submit_parser.add_argument("output")
+    submit_parser.add_argument("--params", help="JSON file with parameter values")
+    submit_parser.add_argument("--detach", action="store_true", help="don't wait for the job to finish")
+
+    for name in ("watch", "cancel", "status"):
+        commands.add_parser(name).add_argument("job", type=int)
+    commands.add_parser("list")
+    commands.add_parser("filters")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.command == "submit":
+        # paths as the service sees them, it may run from another directory
+        message = {"op": "submit", "filter": args.filter, "input": os.path.abspath(args.input),
+                   "output": os.path.abspath(args.output), "params": load_parameters(args.params),
+                   "watch": not args.detach}
+    elif args.command in ("watch", "cancel", "status"):
+        message = {"op": args.command, "job": args.job}
+    else:
+        message = {"op": args.command}
+    try:
+        asyncio.run(request(args, message))
+    except KeyboardInterrupt:
+        print("\nStopped watching, the job keeps running (job_service.py cancel <job> stops it).")
+
+
+if __name__ == "__main__":
+    main()
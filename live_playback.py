@@ -0,0 +1,202 @@
+# live_playback.py
+
+# Listen to a filter in real time instead of rendering a file first. The filter runs inside the
+# sounddevice callback on fixed size blocks, on a track (looped) or on line-in audio.
+#
+#   python live_playback.py ladder2 "C:\music\song.flac" --block-size 256
+#   python live_playback.py ladder2 --line-in
+#
+# While it plays, type "<parameter> <value>" to change a parameter, "stats" for the xrun counters
+# or "q" to stop; changes fade in within one block. The callback itself only copies samples and runs
+# the filter's live processor, which works in preallocated buffers: no allocations, no locks and no
+# printing in the audio thread.
+
+import argparse
+import time
+
+import numpy as np
+import sounddevice as sd
+
+from audio_io import read_audio
+from batch_console import load_parameters
+from main_console import FilterManager
+
+LATENCY_TARGET = 0.020
+
+
+class LiveStats:
+    def __init__(self):
+        self.blocks = 0
+        self.output_underflows = 0
+        self.input_overflows = 0
+        self.late_callbacks = 0  # the callback took longer than the block it had to fill
+        self.max_callback_seconds = 0.0
+
+    def report(self, block_seconds):
+        return (f"{self.blocks} blocks, {self.output_underflows} output underflows, "
+                f"{self.input_overflows} input overflows, {self.late_callbacks} late callbacks, "
+                f"slowest callback {self.max_callback_seconds * 1000:.2f} ms of {block_seconds * 1000:.2f} ms")
+
+
+class LivePlayer:
+    def __init__(self, filter_obj, track=None, sample_rate=44100, block_size=256, device=None, loop=True):
+        # track: (channels, samples) array to play, None for line-in
+        self.filter_obj = filter_obj
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.device = device
+        self.loop = loop
+        self.channels = 2
+        self.stats = LiveStats()
+        self.processor = filter_obj.live_processor(sample_rate, block_size, self.channels)
+        self.dtype = self.processor.dtype
+
+        self.track = None
+        if track is not None:
+            # (samples, channels) like the callback buffers, mono played on both sides
+            if track.shape[0] == 1:
+                track = np.repeat(track, 2, axis=0)
+            self.track = np.ascontiguousarray(track[:2].T, dtype=self.dtype)
+        self.input_block = np.zeros((block_size, self.channels), dtype=self.dtype)
+        self.position = 0
+        self.stream = None
+
+    @property
+    def block_seconds(self):
+        return self.block_size / self.sample_rate
+
+    def _count(self, status, start):
+        stats = self.stats
+        stats.blocks += 1
+        if status.output_underflow:
+            stats.output_underflows += 1
+        if status.input_overflow:
+            stats.input_overflows += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > stats.max_callback_seconds:
+            stats.max_callback_seconds = elapsed
+        if elapsed > self.block_seconds:
+            stats.late_callbacks += 1
+
+    def _track_callback(self, outdata, frames, time_info, status):
+        start = time.perf_counter()
+        block = self.input_block
+        available = min(frames, len(self.track) - self.position)
+        block[:available] = self.track[self.position:self.position + available]
+        self.position += available
+        if available < frames:
+            if self.loop:
+                self.position = frames - available
+                block[available:] = self.track[:self.position]
+            else:
+                block[available:] = 0
+        self.processor.process(block, outdata)
+        self._count(status, start)
+        if available < frames and not self.loop:
+            raise sd.CallbackStop
+
+    def _line_in_callback(self, indata, outdata, frames, time_info, status):
+        start = time.perf_counter()
+        self.processor.process(indata, outdata)
+        self._count(status, start)
+
+    def start(self):
+        options = dict(samplerate=self.sample_rate, blocksize=self.block_size, channels=self.channels,
+                       dtype=self.dtype.name, latency='low', device=self.device)
+        if self.track is None:
+            self.stream = sd.Stream(callback=self._line_in_callback, **options)
+        else:
+            self.stream = sd.OutputStream(callback=self._track_callback, **options)
+        self.stream.start()
+        return self.latency()
+
+    def latency(self):
+        # block plus device latency in seconds, for line-in both directions count
+        device_latency = self.stream.latency
+        if isinstance(device_latency, (tuple, list)):
+            device_latency = sum(device_latency)
+        return self.block_seconds + device_latency
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def set_parameter(self, param, value):
+        # Builds the new LadderDesign here, outside the audio thread, and publishes it: the callback
+        # swaps it in at its next block and fades over to it, the audio thread never waits for this one.
+        previous = self.filter_obj.get_value(param)
+        self.filter_obj.adjust_parameter(param, value)
+        try:
+            self.processor.publish(self.filter_obj.live_design(self.sample_rate, self.block_size))
+        except ValueError:
+            self.filter_obj.adjust_parameter(param, previous)
+            raise
+
+
+def run_console(player):
+    latency = player.start()
+    print(f"Playing, block {player.block_seconds * 1000:.1f} ms, total output latency {latency * 1000:.1f} ms")
+    if latency > LATENCY_TARGET:
+        print(f"Warning: above {LATENCY_TARGET * 1000:.0f} ms, try a smaller --block-size or another --device.")
+    print('Type "<parameter> <value>", "stats" or "q".')
+    try:
+        while player.stream is not None and player.stream.active:
+            command = input("> ").strip()
+            if command in ("q", "quit", "exit"):
+                break
+            if command == "stats":
+                print(player.stats.report(player.block_seconds))
+                continue
+            parts = command.split()
+            if len(parts) != 2:
+                continue
+            param, text = parts
+            current = player.filter_obj.get_value(param)
+            if current is None:
+                print(f"Unknown parameter: {param}")
+                continue
+            try:
+                value = type(current)(text)
+                player.set_parameter(param, value)
+            except ValueError as e:
+                print(f"Not changed: {e}")
+    finally:
+        player.stop()
+        print(player.stats.report(player.block_seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play audio through a filter in real time.")
+    parser.add_argument("filter", help="filter name, as listed by main_console.py")
+    parser.add_argument("track", nargs="?", help="audio file to play (looped), leave out with --line-in")
+    parser.add_argument("--line-in", action="store_true", help="filter the default input device instead")
+    parser.add_argument("--params", help="JSON file with parameter values")
+    parser.add_argument("--block-size", type=int, default=256, help="frames per callback (default 256)")
+    parser.add_argument("--sample-rate", type=int, default=44100, help="sample rate for line-in")
+    parser.add_argument("--device", help="sounddevice device name or number")
+    parser.add_argument("--filter-dir", default="filters")
+    args = parser.parse_args()
+
+    if (args.track is None) == (not args.line_in):
+        parser.error("give a track or --line-in")
+
+    filter_obj = FilterManager(args.filter_dir).get_filter(args.filter)
+    if filter_obj is None:
+        parser.error(f"unknown filter: {args.filter}")
+    if not hasattr(filter_obj, "live_processor"):
+        parser.error(f"{args.filter} has no live mode")
+    filter_obj.adjust_parameters(load_parameters(args.params))
+
+    device = int(args.device) if args.device and args.device.isdigit() else args.device
+    if args.line_in:
+        player = LivePlayer(filter_obj, None, args.sample_rate, args.block_size, device)
+    else:
+        track, sample_rate = read_audio(args.track)
+        player = LivePlayer(filter_obj, track, sample_rate, args.block_size, device)
+    run_console(player)
+
+
+if __name__ == "__main__":
+    main()
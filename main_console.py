@@ -1,38 +1,126 @@
+import ast
 import os
 import importlib
-import numpy as np
-from pydub import AudioSegment
+import json
+from audio_io import ScratchSpace, read_audio, read_audio_memmap, write_audio
+from disk_cache import DecodeCache, RenderCache
+from filters.common.instrumentation import ProgressReporter, RenderMetrics
+
+MANIFEST_FILE = '.filter_manifest.json'
 
 class FilterManager:
+    # Filters are found from their files alone: filters/<Folder>/<Folder>.py defining a class named
+    # Folder.capitalize() (checked by parsing the source, not importing it), with name and description
+    # from its translations.json. That summary is kept in a manifest in the filter directory and only
+    # redone for folders whose files changed. A filter's module is imported and the filter built the
+    # first time get_filter asks for it.
     def __init__(self, filter_dir='filters'):
         self.filter_dir = filter_dir
-        self.filters = self.load_filters()
-
-    def load_filters(self):
-        filters = {}
-        for folder in os.listdir(self.filter_dir):
-            folder_path = os.path.join(self.filter_dir, folder)
-            if os.path.isdir(folder_path):
-                module_path = os.path.join(folder_path, f"{folder}.py")
-                if os.path.exists(module_path):
-                    module_name = f"filters.{folder}.{folder}"
-                    module = importlib.import_module(module_name)
-                    filter_class = getattr(module, folder.capitalize())
-                    filters[folder] = filter_class(
-                        os.path.join(folder_path, 'translations.json'),
-                        os.path.join(folder_path, 'default_values.json'),
-                        os.path.join(folder_path, 'custom_values.json')
-                    )
-        return filters
-
-    def list_filters(self):
-        for name, filter_obj in self.filters.items():
-            info = filter_obj.get_info()
+        self.filters = {}
+        self.manifest = self.load_manifest()
+
+    def _files(self, folder):
+        folder_path = os.path.join(self.filter_dir, folder)
+        return os.path.join(folder_path, f"{folder}.py"), os.path.join(folder_path, 'translations.json')
+
+    def _fingerprint(self, paths):
+        fingerprint = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                fingerprint.append([stat.st_mtime_ns, stat.st_size])
+            except OSError:
+                fingerprint.append(None)
+        return fingerprint
+
+    def _scan(self, folder):
+        module_path, translations_path = self._files(folder)
+        class_name = folder.capitalize()
+        with open(module_path, 'r', encoding='utf-8') as file:
+            tree = ast.parse(file.read(), module_path)
+        defined = set()
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef):
+                defined.add(node.name)
+            elif isinstance(node, ast.Assign):
+                defined.update(target.id for target in node.targets if isinstance(target, ast.Name))
+        if class_name not in defined:
+            return None
+        translations = {}
+        if os.path.exists(translations_path):
+            with open(translations_path, 'r', encoding='utf-8') as file:
+                translations = json.load(file)
+        return {
+            "class": class_name,
+            "name": translations.get("name", {}),
+            "description": translations.get("description", {}),
+        }
+
+    def load_manifest(self):
+        manifest_path = os.path.join(self.filter_dir, MANIFEST_FILE)
+        try:
+            with open(manifest_path, 'r') as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            cached = {}
+
+        manifest = {}
+        for folder in sorted(os.listdir(self.filter_dir)):
+            module_path, translations_path = self._files(folder)
+            if not os.path.isfile(module_path):
+                continue
+            fingerprint = self._fingerprint([module_path, translations_path])
+            entry = cached.get(folder)
+            if entry is None or entry.get("fingerprint") != fingerprint:
+                entry = self._scan(folder)
+                if entry is None:
+                    continue
+                entry["fingerprint"] = fingerprint
+            manifest[folder] = entry
+
+        if manifest != cached:
+            try:
+                with open(manifest_path, 'w') as file:
+                    json.dump(manifest, file, indent=4)
+            except OSError:
+                pass  # read-only install, scan again next time
+        # by filter name
+        return {folder.lower(): dict(entry, folder=folder) for folder, entry in manifest.items()}
+
+    def load_filter(self, name):
+        entry = self.manifest[name]
+        folder = entry["folder"]
+        folder_path = os.path.join(self.filter_dir, folder)
+        module = importlib.import_module(f"filters.{folder}.{folder}")
+        filter_class = getattr(module, entry["class"])
+        filter_obj = filter_class(
+            os.path.join(folder_path, 'translations.json'),
+            os.path.join(folder_path, 'default_values.json'),
+            os.path.join(folder_path, 'custom_values.json')
+        )
+        if hasattr(filter_obj, 'compile_parameters'):
+            # typed and validated once here, a broken value stops us before any audio is decoded
+            try:
+                filter_obj.compile_parameters()
+            except ValueError as e:
+                raise ValueError(f"{folder}: {e}") from e
+        return filter_obj
+
+    def filter_names(self):
+        return list(self.manifest)
+
+    def list_filters(self, language='en'):
+        for name, entry in self.manifest.items():
             print(f"\n{name.capitalize()} Filter:")
-            print(f"  Description: {info['description']}")
+            print(f"  Description: {entry['description'].get(language, 'description')}")
 
     def get_filter(self, name):
-        return self.filters.get(name.lower())
+        name = name.lower()
+        if name not in self.manifest:
+            return None
+        if name not in self.filters:
+            self.filters[name] = self.load_filter(name)
+        return self.filters[name]
 
 def print_filter_info(filter_obj):
     info = filter_obj.get_info()
@@ -68,33 +156,86 @@ def adjust_filter_parameters(filter_obj):
         except ValueError as e:
             print(f"Error: {str(e)}")
 
-def process_audio(filter_obj, input_file, output_file):
-    # Load the MP3 file
-    audio = AudioSegment.from_mp3(input_file)
+def process_audio(filter_obj, input_file, output_file, scratch_dir=None, cache=None, decode_cache=None,
+                  progress=None, metrics=None):
+    # Returns the duration of the track in seconds.
+    # With scratch_dir the input and output live in memory mapped files in that directory
+    # instead of RAM, for multi-hour tracks on machines with little memory.
+    # With a RenderCache, a track rendered before with the same filter and parameters is copied from it.
+    # With a DecodeCache, the input is read from a decoded copy (memory mapped) made the first time.
+    # progress(done, total) goes to the filter's execute, see TinnitusFilter.process_audio.
+    # metrics (a RenderMetrics) gets the decode and encode times here and the rest from the filter.
+    metrics = metrics or RenderMetrics()
+    if cache is not None:
+        with metrics.stage("cache"):
+            key = cache.render_key(input_file, filter_obj, output_file)
+            meta = cache.fetch(key, output_file)
+        if meta is not None:
+            print(f"\nFound in the render cache. Output saved as '{output_file}'.")
+            return meta["duration"]
+        duration = process_audio(filter_obj, input_file, output_file, scratch_dir, decode_cache=decode_cache,
+                                 progress=progress, metrics=metrics)
+        with metrics.stage("cache"):
+            cache.store(key, output_file, {"duration": duration})
+        return duration
 
-    # Convert to numpy array
-    samples = np.array(audio.get_array_of_samples()).reshape((-1, audio.channels)).T
-    sample_rate = audio.frame_rate
+    if decode_cache is not None:
+        with metrics.stage("decode"):
+            samples, sample_rate = decode_cache.load(input_file)
+        filter_obj.set_input(samples, sample_rate)
+        print("\nProcessing audio...")
+        if scratch_dir is not None:
+            with ScratchSpace(scratch_dir) as scratch:
+                filtered_samples = filter_obj.execute(scratch.array(samples.shape), progress, metrics)
+                with metrics.stage("encode"):
+                    write_audio(output_file, filtered_samples, sample_rate)
+                del filtered_samples
+        else:
+            filtered_samples = filter_obj.execute(progress=progress, metrics=metrics)
+            with metrics.stage("encode"):
+                write_audio(output_file, filtered_samples, sample_rate)
+            del filtered_samples
+        duration = samples.shape[1] / sample_rate
+        del samples
+        filter_obj.set_input(None, sample_rate)
+        filter_obj.raw_out = None
+        print(f"\nAudio processing complete. Output saved as '{output_file}'.")
+        return duration
+
+    if scratch_dir is not None:
+        with ScratchSpace(scratch_dir) as scratch:
+            with metrics.stage("decode"):
+                samples, sample_rate = read_audio_memmap(input_file, scratch)
+            duration = samples.shape[1] / sample_rate
+            filter_obj.set_input(samples, sample_rate)
+            print("\nProcessing audio (disk backed)...")
+            filtered_samples = filter_obj.execute(scratch.array(samples.shape), progress, metrics)
+            with metrics.stage("encode"):
+                write_audio(output_file, filtered_samples, sample_rate)
+            # let go of the memmaps, otherwise the scratch files can't be removed on Windows
+            del samples, filtered_samples
+            filter_obj.set_input(None, sample_rate)
+            filter_obj.raw_out = None
+        print(f"\nAudio processing complete. Output saved as '{output_file}'.")
+        return duration
+
+    # Load the audio file as a (channels, samples) float array
+    with metrics.stage("decode"):
+        samples, sample_rate = read_audio(input_file)
 
     # Set the input for the filter
     filter_obj.set_input(samples, sample_rate)
 
     # Process the audio
     print("\nProcessing audio...")
-    filtered_samples = filter_obj.execute()
-
-    # Convert back to AudioSegment
-    filtered_audio = AudioSegment(
-        filtered_samples.T.tobytes(),
-        frame_rate=sample_rate,
-        sample_width=audio.sample_width,
-        channels=audio.channels
-    )
+    filtered_samples = filter_obj.execute(progress=progress, metrics=metrics)
 
-    # Export the filtered audio
-    filtered_audio.export(output_file, format="mp3")
+    # Export the filtered audio, the format follows the file extension
+    with metrics.stage("encode"):
+        write_audio(output_file, filtered_samples, sample_rate)
 
     print(f"\nAudio processing complete. Output saved as '{output_file}'.")
+    return samples.shape[1] / sample_rate
 
 def main():
     manager = FilterManager()
@@ -126,7 +267,10 @@ def main():
     input_file = input("\nEnter the name of the input MP3 file: ")
     output_file = input("Enter the name for the output MP3 file: ")
 
-    process_audio(filter_obj, input_file, output_file)
+    metrics = RenderMetrics()
+    process_audio(filter_obj, input_file, output_file, cache=RenderCache(), decode_cache=DecodeCache(),
+                  progress=ProgressReporter(), metrics=metrics)
+    print(metrics.report())
 
     # Save custom values
     save_custom = input("Do you want to save your custom values? (yes/no): ").lower()
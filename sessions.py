@@ -0,0 +1,154 @@
+# sessions.py
+
+# The tone finder and the filter console without a console. Every step is a function call: the
+# answers come from a responder and the tones go to a player, and both can be scripted. That way a
+# session runs in a test, or a few thousand run in a row with simulated listeners and a NullPlayer,
+# to see how fast the tone search converges and how fast a filter renders. No keyboard, no sound card.
+#
+#   result = tone_session(SimulatedListener(6500, jitter_cents=30))
+#   session = FilterSession("ladder2")
+#   session.configure(bandwidth=200)
+#   filtered = session.render(samples, 44100)
+
+import math
+import time
+
+import numpy as np
+
+from main_console import FilterManager, process_audio
+from tone_matching import HIGHER, LOWER, MATCH, NO, match_tone
+
+
+class NullPlayer:
+    # TonePlayer without a sound card: takes the tones, counts them and is done right away
+    def __init__(self):
+        self.tones = 0
+        self.samples = 0
+
+    def play(self, tone):
+        self.tones += 1
+        self.samples += len(tone)
+
+    def wait(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ScriptedResponder:
+    # plays back a list of answers, stops (None) when it runs out
+    def __init__(self, answers):
+        self.answers = iter(answers)
+        self.asked = []  # (frequency, checking) of every question
+
+    def __call__(self, frequency, checking):
+        self.asked.append((frequency, checking))
+        return next(self.answers, None)
+
+
+class SimulatedListener:
+    # Answers like someone with tinnitus at `frequency`. Each tone is heard with jitter_cents of random
+    # pitch error. With octave_error (+1 or -1) the tones are compared against the tinnitus an octave
+    # off, until the octave check plays a tone close to the real one.
+    def __init__(self, frequency, jitter_cents=0.0, octave_error=0, seed=None):
+        self.frequency = frequency
+        self.position = math.log2(frequency)
+        self.jitter = jitter_cents / 1200
+        self.octave_error = octave_error
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, frequency, checking):
+        heard = math.log2(frequency) + (self.rng.normal(0, self.jitter) if self.jitter else 0.0)
+        if checking:
+            # "is this one closer": only a tone within half an octave of the real tinnitus is
+            if abs(heard - self.position) < 0.5:
+                self.octave_error = 0
+                return MATCH
+            return NO
+        return HIGHER if self.position + self.octave_error > heard else LOWER
+
+
+def tone_session(respond, player=None, low=100.0, high=20000.0, duration=1.0, resolution_cents=50,
+                 octave_check=True, sample_rate=44100):
+    # match_tone on a NullPlayer unless a player is given.
+    # Returns {"frequency", "answers", "seconds"}, frequency None if the responder stopped.
+    answers = 0
+
+    def counted(frequency, checking):
+        nonlocal answers
+        answers += 1
+        return respond(frequency, checking)
+
+    start = time.perf_counter()
+    frequency = match_tone(counted, player or NullPlayer(), low, high, duration, resolution_cents, octave_check,
+                           sample_rate)
+    return {"frequency": frequency, "answers": answers, "seconds": time.perf_counter() - start}
+
+
+def simulate_tone_sessions(count, low=100.0, high=20000.0, jitter_cents=0.0, octave_error_rate=0.0, seed=0,
+                           **options):
+    # count sessions with simulated listeners at random (log uniform) frequencies, options go to tone_session.
+    # Every result also has "target" and "error_cents".
+    rng = np.random.default_rng(seed)
+    results = []
+    for _ in range(count):
+        target = float(2 ** rng.uniform(math.log2(low), math.log2(high)))
+        octave_error = int(rng.choice((-1, 1))) if rng.random() < octave_error_rate else 0
+        listener = SimulatedListener(target, jitter_cents, octave_error, seed=rng.integers(2 ** 32))
+        result = tone_session(listener, low=low, high=high, **options)
+        result["target"] = target
+        result["error_cents"] = 1200 * math.log2(result["frequency"] / target)
+        results.append(result)
+    return results
+
+
+def summarize_tone_sessions(results):
+    errors = np.abs([result["error_cents"] for result in results])
+    answers = np.array([result["answers"] for result in results])
+    seconds = sum(result["seconds"] for result in results)
+    return {
+        "sessions": len(results),
+        "sessions_per_minute": 60 * len(results) / seconds if seconds else float('inf'),
+        "mean_answers": float(answers.mean()),
+        "max_answers": int(answers.max()),
+        "median_error_cents": float(np.median(errors)),
+        "p95_error_cents": float(np.percentile(errors, 95)),
+        "octave_misses": int(np.sum(errors > 600)),
+    }
+
+
+class FilterSession:
+    # main_console.main as calls: pick a filter, look at it, configure it, render arrays or files
+    def __init__(self, filter_name, manager=None, language='en'):
+        self.manager = manager or FilterManager()
+        self.filter_obj = self.manager.get_filter(filter_name)
+        if self.filter_obj is None:
+            raise ValueError(f"Filter '{filter_name}' not found.")
+        self.filter_obj.set_language(language)
+
+    def info(self):
+        return self.filter_obj.get_info()
+
+    def configure(self, **values):
+        # all values at once and validated first, a bad one changes nothing (ValueError)
+        self.filter_obj.adjust_parameters(values)
+        return {name: self.filter_obj.get_value(name) for name in values}
+
+    def render(self, samples, sample_rate, out=None, progress=None, metrics=None):
+        # (channels, samples) in, filtered array out; the filter lets go of both afterwards
+        self.filter_obj.set_input(samples, sample_rate)
+        try:
+            return self.filter_obj.execute(out, progress, metrics)
+        finally:
+            self.filter_obj.set_input(None, sample_rate)
+            self.filter_obj.raw_out = None
+
+    def render_file(self, input_file, output_file, scratch_dir=None, cache=None, decode_cache=None, progress=None,
+                    metrics=None):
+        # returns the duration of the track in seconds
+        return process_audio(self.filter_obj, input_file, output_file, scratch_dir, cache, decode_cache, progress,
+                             metrics)
+
+    def save(self, path):
+        self.filter_obj.save_custom_values(path)
@@ -1,16 +1,17 @@
-import numpy as np
-import sounddevice as sd
-import time
+from tone_matching import MATCH, NO, TonePlayer, match_tone
 
-def generate_tone(frequency, duration=1, sample_rate=44100):
-    t = np.linspace(0, duration, int(sample_rate * duration), False)
-    tone = np.sin(2 * np.pi * frequency * t)
-    return tone
-
-def play_tone(frequency, duration=1, sample_rate=44100):
-    tone = generate_tone(frequency, duration, sample_rate)
-    sd.play(tone, sample_rate)
-    sd.wait()
+def ask(frequency, checking):
+    while True:
+        if checking:
+            response = input(f"Octave check, {frequency:.0f} Hz. Closer to your tinnitus than the match? (y/n/q): ").lower()
+            answers = {"y": MATCH, "n": NO}
+        else:
+            response = input(f"{frequency:.0f} Hz. Your input (+/-/space/q): ").lower()
+            answers = {"+": "+", "-": "-", " ": MATCH, "=": MATCH}
+        if response == "q":
+            return None
+        if response in answers:
+            return answers[response]
 
 def find_tinnitus_frequency():
     print("Welcome to the Tinnitus Tone Finder")
@@ -19,31 +20,17 @@ def find_tinnitus_frequency():
     print("  - : if your tinnitus is lower than the tone")
     print("  Space : if the tone matches your tinnitus")
     print("  q : to quit the process")
-    
-    low = 100
-    high = 20000
-    
-    while high - low > 10:
-        mid = (low + high) // 2
-        print(f"\nPlaying tone at {mid} Hz")
-        play_tone(mid)
-        
-        response = input("Your input (+/-/space/q): ").lower()
-        
-        if response == " ":
-            return mid
-        elif response == "+":
-            low = mid
-        elif response == "-":
-            high = mid
-        elif response == "q":
-            return None
-    
-    return (low + high) // 2
+    print("After a match the tones an octave up and down are played, those are easy to mix up.")
+
+    player = TonePlayer()
+    try:
+        return match_tone(ask, player)
+    finally:
+        player.close()
 
 if __name__ == "__main__":
     result = find_tinnitus_frequency()
     if result:
-        print(f"\nYour tinnitus frequency is approximately {result} Hz")
+        print(f"\nYour tinnitus frequency is approximately {result:.0f} Hz")
     else:
-        print("\nTone finding process was interrupted.")
\ No newline at end of file
+        print("\nTone finding process was interrupted.")
\ No newline at end of file
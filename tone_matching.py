@@ -0,0 +1,209 @@
+# tone_matching.py
+
+# Finding the tinnitus frequency by ear. Pitch is heard in octaves, not in Hz, so the search bisects
+# log2(frequency): every answer halves the remaining range in octaves, and 100 Hz - 20 kHz
+# (7.6 octaves) is down to a quarter tone in about 8 answers, at every pitch alike.
+# Tinnitus is easily matched an octave off, so a match is followed by the tones an octave
+# above and below; if one of those sounds closer, the search continues around that one.
+#
+# While the listener answers, the tones that can come next are already rendered in a background
+# thread, and a TonePlayer keeps one output stream open for the whole session: a trial only hands a
+# finished buffer to the running stream.
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from filters.common.oscillator import SineOscillator
+
+HIGHER, LOWER, MATCH, NO = "+", "-", "=", "n"
+
+
+class ToneSearch:
+    # candidate() is the frequency to play, answer() takes HIGHER (tinnitus is higher than the tone),
+    # LOWER or MATCH; during the octave check the answers are MATCH (this one is closer) or NO.
+    def __init__(self, low=100.0, high=20000.0, resolution_cents=50, octave_check=True):
+        self.low = np.log2(low)
+        self.high = np.log2(high)
+        self.range = (self.low, self.high)
+        self.resolution = resolution_cents / 1200
+        self.octave_check = octave_check
+        self.checks = []      # octave candidates still to play
+        self.checked = False  # one octave check per session, a second one would go around in circles
+        self.match = None
+        self.result = None
+        self.trials = 0
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    def candidate(self):
+        if self.checks:
+            return 2 ** self.checks[0]
+        return 2 ** ((self.low + self.high) / 2)
+
+    def next_candidates(self):
+        # every frequency the next candidate() can be, depending on the answer
+        if self.done:
+            return []
+        if self.checks:
+            return [2 ** position for position in self.checks[1:2]] + [2 ** (self.checks[0] + offset) for offset in (-0.25, 0.25)]
+        middle = (self.low + self.high) / 2
+        following = [2 ** ((self.low + middle) / 2), 2 ** ((middle + self.high) / 2)]
+        if self.octave_check and not self.checked:
+            following += [2 ** (middle + 1), 2 ** (middle - 1)]
+        return following
+
+    def answer(self, response):
+        self.trials += 1
+        if self.checks:
+            return self._answer_check(response)
+        middle = (self.low + self.high) / 2
+        if response == HIGHER:
+            self.low = middle
+        elif response == LOWER:
+            self.high = middle
+        elif response == MATCH:
+            self._matched(middle)
+            return
+        else:
+            raise ValueError(f"Unknown answer: {response!r}")
+        if self.high - self.low <= self.resolution:
+            self._matched((self.low + self.high) / 2)
+
+    def _matched(self, position):
+        self.match = position
+        if self.octave_check and not self.checked:
+            low, high = self.range
+            self.checks = [octave for octave in (position + 1, position - 1) if low <= octave <= high]
+            self.checked = True
+            if self.checks:
+                return
+        self.result = 2 ** position
+
+    def _answer_check(self, response):
+        octave = self.checks.pop(0)
+        if response == MATCH:
+            # an octave off: search again within half an octave of that tone
+            self.checks = []
+            low, high = self.range
+            self.low, self.high = max(octave - 0.5, low), min(octave + 0.5, high)
+        elif response != NO:
+            raise ValueError(f"Unknown answer: {response!r}")
+        elif not self.checks:
+            self.result = 2 ** self.match
+
+
+def render_tone(frequency, duration=1.0, sample_rate=44100, fade=0.01, gain=0.5):
+    # float32 tone with short fades, so tones start and stop without clicks
+    tone = SineOscillator(frequency, sample_rate).render(np.empty(int(sample_rate * duration)), gain)
+    fade_samples = min(int(fade * sample_rate), len(tone) // 2)
+    if fade_samples:
+        ramp = np.linspace(0, 1, fade_samples, endpoint=False)
+        tone[:fade_samples] *= ramp
+        tone[len(tone) - fade_samples:] *= ramp[::-1]
+    return tone.astype(np.float32)
+
+
+class TonePrerenderer:
+    # renders tones in a background thread, get() waits only if the tone isn't done yet
+    def __init__(self, duration=1.0, sample_rate=44100, max_tones=32):
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.max_tones = max_tones
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.tones = {}
+
+    def _key(self, frequency):
+        return round(frequency, 3)
+
+    def prepare(self, frequencies):
+        for frequency in frequencies:
+            key = self._key(frequency)
+            if key not in self.tones:
+                self.tones[key] = self.executor.submit(render_tone, frequency, self.duration, self.sample_rate)
+        while len(self.tones) > self.max_tones:
+            self.tones.pop(next(iter(self.tones)))
+
+    def get(self, frequency):
+        self.prepare([frequency])
+        return self.tones[self._key(frequency)].result()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TonePlayer:
+    # One output stream for the whole session. play() queues a rendered tone, the callback copies it
+    # out block by block and plays silence in between.
+    def __init__(self, sample_rate=44100, block_size=512, device=None):
+        import sounddevice as sd
+        self.sample_rate = sample_rate
+        self.tones = queue.Queue()
+        self.current = None
+        self.position = 0
+        self.finished = threading.Event()
+        self.finished.set()
+        # play() clears finished and queues under this lock, the callback finds the queue empty and sets
+        # finished under it, so neither can slip in between the other's two steps
+        self.lock = threading.Lock()
+        self.stream = sd.OutputStream(samplerate=sample_rate, blocksize=block_size, channels=1, dtype='float32',
+                                      device=device, callback=self._callback)
+        self.stream.start()
+
+    def _callback(self, outdata, frames, time_info, status):
+        written = 0
+        while written < frames:
+            if self.current is None:
+                with self.lock:
+                    try:
+                        self.current, self.position = self.tones.get_nowait(), 0
+                    except queue.Empty:
+                        self.finished.set()
+                if self.current is None:
+                    outdata[written:, 0] = 0
+                    return
+            length = min(frames - written, len(self.current) - self.position)
+            outdata[written:written + length, 0] = self.current[self.position:self.position + length]
+            written += length
+            self.position += length
+            if self.position >= len(self.current):
+                self.current = None
+
+    def play(self, tone):
+        with self.lock:
+            self.finished.clear()
+            self.tones.put(tone)
+
+    def wait(self):
+        self.finished.wait()
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+
+def match_tone(respond, player, low=100.0, high=20000.0, duration=1.0, resolution_cents=50, octave_check=True,
+               sample_rate=44100):
+    # respond(frequency, checking) -> HIGHER/LOWER/MATCH (NO during the octave check), or None to stop.
+    # Returns the matched frequency, None if stopped.
+    search = ToneSearch(low, high, resolution_cents, octave_check)
+    tones = TonePrerenderer(duration, sample_rate)
+    try:
+        while not search.done:
+            frequency = search.candidate()
+            checking = bool(search.checks)
+            player.play(tones.get(frequency))
+            # render whatever the answer leads to while the tone plays and the listener thinks
+            tones.prepare(search.next_candidates())
+            player.wait()
+            response = respond(frequency, checking)
+            if response is None:
+                return None
+            search.answer(response)
+        return search.result
+    finally:
+        tones.close()